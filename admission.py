@@ -0,0 +1,122 @@
+# Admission control and per-client rate limiting for the /analyze endpoint
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request must be turned away; carries the HTTP status and Retry-After seconds."""
+
+    def __init__(self, status_code, detail, retry_after):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class TokenBucketLimiter:
+    """
+    Per-client token buckets: each client may burst up to `burst` requests
+    and then sustain `rate_per_sec`. Idle buckets are evicted LRU-first once
+    more than `max_clients` are tracked.
+    """
+
+    def __init__(self, rate_per_sec, burst, max_clients=10000):
+        self.rate_per_sec = rate_per_sec
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, client_id, now=None):
+        """
+        Take one token for `client_id`.
+        Returns:
+            0.0 if the request is allowed, else seconds until a token is available
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(client_id, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate_per_sec)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate_per_sec
+            self._buckets[client_id] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class AdmissionController:
+    """
+    Bounds concurrent pipeline runs to `max_in_flight` and the number of
+    requests waiting for a slot to `max_queue_depth`. Anything beyond that is
+    rejected immediately with 503 rather than queued without limit.
+    """
+
+    def __init__(self, max_in_flight, max_queue_depth):
+        self.max_in_flight = max_in_flight
+        self.max_queue_depth = max_queue_depth
+        self.in_flight = 0
+        self.waiting = 0
+        # Moving average of service time, used to estimate Retry-After
+        self.avg_service_sec = 1.0
+        self._semaphore = None
+        self._loop = None
+
+    def _get_semaphore(self):
+        # asyncio primitives are bound to one event loop; rebuild if the loop changed
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._loop = loop
+        return self._semaphore
+
+    def retry_after(self):
+        """Estimated seconds until a slot frees up for a new request."""
+        backlog = self.waiting + 1
+        return max(1, math.ceil(self.avg_service_sec * backlog / self.max_in_flight))
+
+    async def acquire(self):
+        """
+        Wait for an in-flight slot; pair with release().
+        Returns:
+            Time spent queued (seconds)
+        Raises AdmissionRejected(503) when all slots are busy and the queue is full.
+        """
+        semaphore = self._get_semaphore()
+        if self.in_flight >= self.max_in_flight and self.waiting >= self.max_queue_depth:
+            raise AdmissionRejected(503, "Server is at capacity, please retry later.", self.retry_after())
+        self.waiting += 1
+        t0 = time.monotonic()
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        return time.monotonic() - t0
+
+    def release(self, service_sec):
+        """Free a slot taken by acquire(). Must run on the event loop thread."""
+        self.in_flight -= 1
+        self._semaphore.release()
+        self.avg_service_sec = 0.8 * self.avg_service_sec + 0.2 * service_sec
+
+    @asynccontextmanager
+    async def admit(self):
+        """
+        Hold an in-flight slot for the duration of the block. Yields the time spent queued (seconds).
+        Raises AdmissionRejected(503) when all slots are busy and the queue is full.
+        """
+        queue_wait = await self.acquire()
+        t1 = time.monotonic()
+        try:
+            yield queue_wait
+        finally:
+            self.release(time.monotonic() - t1)
@@ -0,0 +1,48 @@
+# In-memory store of analysis context snapshots, used for incremental re-analysis
+import copy
+import threading
+import uuid
+from collections import OrderedDict
+
+
+class AnalysisStore:
+    """
+    Bounded LRU map of analysis_id -> context snapshot.
+    Snapshots keep the preprocessed image so downstream stages and the report
+    can be recomputed without rerunning rooftop detection.
+    """
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, context):
+        """
+        Store a snapshot of `context` (the image is shared, everything else is copied).
+        Returns:
+            analysis_id: New identifier for the snapshot
+        """
+        analysis_id = uuid.uuid4().hex
+        snapshot = copy.deepcopy({k: v for k, v in context.items() if k != 'image'})
+        snapshot['image'] = context.get('image')
+        snapshot['analysis_id'] = analysis_id
+        with self._lock:
+            self._entries[analysis_id] = snapshot
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return analysis_id
+
+    def get(self, analysis_id):
+        """Return a private copy of the snapshot, or None if unknown or evicted."""
+        with self._lock:
+            snapshot = self._entries.get(analysis_id)
+            if snapshot is None:
+                return None
+            self._entries.move_to_end(analysis_id)
+        context = copy.deepcopy({k: v for k, v in snapshot.items() if k != 'image'})
+        context['image'] = snapshot['image']
+        return context
+
+    def __len__(self):
+        return len(self._entries)
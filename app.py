@@ -1,22 +1,29 @@
-from fastapi import FastAPI, File, UploadFile
+from fastapi import Body, FastAPI, File, Form, Request, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from PIL import Image
+from contextlib import asynccontextmanager
+import asyncio
 import io
+import ipaddress
 import os
 import time
 import logging
+import threading
+import queue
 from dotenv import load_dotenv
 from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
 
-from image_acquisition import fetch_and_preprocess_image
-from rooftop_detection import detect_and_segment_rooftop
-from shading_analysis import analyze_shading_and_obstacles
-from solar_assessment import assess_solar_potential
-from system_design import recommend_system
-from cost_roi_analysis import analyze_cost_and_roi
-from report_generation import generate_report
-from utils import validate_rooftop_result, compute_confidence_score
+from pipeline import analysis_store, iter_analysis_pipeline, run_analysis_pipeline, reevaluate_analysis
+from job_queue import JobQueue, JobWorkerPool, PRIORITY_CLASSES, validate_webhook_url
+import rooftop_detection
+import report_generation
+from report_generation import report_paths, report_status
+from serialization import dumps_json, render_context
+from admission import AdmissionController, AdmissionRejected, TokenBucketLimiter
+from user_feedback import FeedbackStore, make_feedback_record
+from calibration import start_periodic_calibration
 
 load_dotenv()
 
@@ -27,14 +34,52 @@ logger = logging.getLogger("performance")
 # Prometheus metrics
 ANALYZE_REQUESTS = Counter('analyze_requests_total', 'Total /analyze requests')
 ANALYZE_LATENCY = Histogram('analyze_latency_seconds', 'Latency for /analyze endpoint (seconds)')
-ROOFTOP_LATENCY = Histogram('rooftop_detection_latency_seconds', 'Latency for rooftop detection (seconds)')
-VALIDATION_LATENCY = Histogram('validation_latency_seconds', 'Latency for validation (seconds)')
-SHADING_LATENCY = Histogram('shading_analysis_latency_seconds', 'Latency for shading analysis (seconds)')
-ASSESSMENT_LATENCY = Histogram('assessment_latency_seconds', 'Latency for solar assessment (seconds)')
-RECOMMENDATION_LATENCY = Histogram('recommendation_latency_seconds', 'Latency for system recommendation (seconds)')
-ROI_LATENCY = Histogram('roi_latency_seconds', 'Latency for ROI analysis (seconds)')
+ANALYZE_QUEUE_WAIT = Histogram('analyze_queue_wait_seconds', 'Time /analyze requests wait for an in-flight slot (seconds)')
+ANALYZE_REJECTED = Counter('analyze_rejected_total', 'Requests rejected by admission control', ['reason'])
+JOBS_SUBMITTED = Counter('jobs_submitted_total', 'Total jobs submitted via /jobs')
 
-app = FastAPI()
+# Admission control settings
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+admission = AdmissionController(
+    max_in_flight=int(os.environ.get("ANALYZE_MAX_IN_FLIGHT", "4")),
+    max_queue_depth=int(os.environ.get("ANALYZE_MAX_QUEUE_DEPTH", "16"))
+)
+rate_limiter = TokenBucketLimiter(
+    rate_per_sec=float(os.environ.get("ANALYZE_RATE_LIMIT_PER_MIN", "30")) / 60.0,
+    burst=int(os.environ.get("ANALYZE_RATE_LIMIT_BURST", "10"))
+)
+# Reverse proxies (IPs or CIDRs, comma-separated) whose X-Forwarded-For is trusted for rate limiting
+TRUSTED_PROXIES = [
+    ipaddress.ip_network(p.strip(), strict=False)
+    for p in os.environ.get("TRUSTED_PROXIES", "").split(",") if p.strip()
+]
+
+# --- Startup warmup ---
+# Heavy dependencies (openai, the report process pool) load lazily. warmup() preloads
+# them after startup so the first request does not pay for it; /ready reports when done.
+_ready = threading.Event()
+
+def warmup():
+    t0 = time.time()
+    try:
+        rooftop_detection.warm_up()
+        report_generation.warm_up()
+    except Exception as e:
+        # A failed warmup only costs first-request latency; still report ready
+        logger.warning(f"Warmup failed: {e}")
+    _ready.set()
+    logger.info(f"Warmup completed in {time.time() - t0:.3f}s")
+
+@asynccontextmanager
+async def lifespan(app):
+    threading.Thread(target=warmup, name="warmup", daemon=True).start()
+    # Load the saved confidence calibration and refit it from feedback periodically (0 disables refits)
+    calibration_interval = float(os.environ.get("CALIBRATION_INTERVAL_SEC", "3600"))
+    if calibration_interval > 0:
+        start_periodic_calibration(calibration_interval)
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS for local frontend development
 app.add_middleware(
@@ -45,120 +90,323 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.get("/ready")
+async def ready():
+    if not _ready.is_set():
+        return JSONResponse(content={"status": "warming_up"}, status_code=503, headers={"Retry-After": "1"})
+    return {"status": "ready"}
+
+def rejection_response(status_code, detail, retry_after=None):
+    headers = {"Retry-After": str(retry_after)} if retry_after is not None else None
+    return JSONResponse(content={"error": detail}, status_code=status_code, headers=headers)
+
+def upload_too_large():
+    return rejection_response(413, f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit.")
+
+def is_trusted_proxy(host):
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXIES)
+
+def client_id(request):
+    """
+    Identify the caller for rate limiting. This is the peer address, unless the
+    peer is a trusted proxy: then it is the right-most X-Forwarded-For hop that
+    is not itself a trusted proxy (hops further left are client-controlled).
+    """
+    host = request.client.host if request.client else "unknown"
+    if not is_trusted_proxy(host):
+        return host
+    hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else host
+
+@app.middleware("http")
+async def analyze_admission_control(request: Request, call_next):
+    """
+    Guard /analyze before the upload body is parsed: enforce the upload size
+    limit from Content-Length, the per-client token bucket, and the bounded
+    in-flight/queue-depth limits (fast 503 + Retry-After when saturated).
+    /feedback shares the token bucket so one caller cannot flood the calibration data.
+    """
+    if request.url.path not in ("/analyze", "/analyze/stream", "/jobs", "/feedback") or request.method != "POST":
+        return await call_next(request)
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+        ANALYZE_REJECTED.labels(reason="upload_too_large").inc()
+        return upload_too_large()
+    if request.url.path == "/jobs":
+        return await call_next(request)
+    wait = rate_limiter.try_acquire(client_id(request))
+    if wait > 0:
+        ANALYZE_REJECTED.labels(reason="rate_limited").inc()
+        return rejection_response(429, "Rate limit exceeded.", max(1, int(wait + 0.999)))
+    if request.url.path in ("/analyze/stream", "/feedback"):
+        # The streaming handler holds its slot until the pipeline finishes, not just until headers are sent
+        return await call_next(request)
+    try:
+        async with admission.admit() as queue_wait:
+            ANALYZE_QUEUE_WAIT.observe(queue_wait)
+            return await call_next(request)
+    except AdmissionRejected as e:
+        ANALYZE_REJECTED.labels(reason="at_capacity").inc()
+        return rejection_response(e.status_code, e.detail, e.retry_after)
+
+class UploadTooLarge(Exception):
+    pass
+
+class UploadSizeLimitMiddleware:
+    """
+    Count request body bytes as they arrive on the upload endpoints and answer
+    413 as soon as MAX_UPLOAD_BYTES is exceeded, so bodies sent without
+    Content-Length (chunked) are cut off before Starlette spools them to disk.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in ("/analyze", "/analyze/stream", "/jobs"):
+            return await self.app(scope, receive, send)
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > MAX_UPLOAD_BYTES:
+                    exceeded = True
+                    raise UploadTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            # Drop whatever error response the app built from the aborted body parse
+            if exceeded:
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            pass
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded and not response_started:
+            ANALYZE_REJECTED.labels(reason="upload_too_large").inc()
+            await upload_too_large()(scope, receive, send)
+
+# Outermost, so the body is bounded before any other middleware or the route reads it
+app.add_middleware(UploadSizeLimitMiddleware)
+
+async def read_upload(file):
+    """Read an upload, enforcing MAX_UPLOAD_BYTES (a backstop; UploadSizeLimitMiddleware already bounds the body)."""
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        return None
+    contents = await file.read(MAX_UPLOAD_BYTES + 1)
+    if len(contents) > MAX_UPLOAD_BYTES:
+        return None
+    return contents
+
+def decode_upload(contents):
+    """Decode uploaded image bytes into the 512x512 RGB image the pipeline expects."""
+    image = Image.open(io.BytesIO(contents)).convert('RGB')
+    return image.resize((512, 512))
+
 @app.post("/analyze")
-async def analyze_image(file: UploadFile = File(...)):
+async def analyze_image(request: Request, file: UploadFile = File(...)):
     # Increment Prometheus request counter
     ANALYZE_REQUESTS.inc()
-    perf = {}
     start_time = time.time()
 
     # Read image from upload and preprocess
-    contents = await file.read()
-    image = Image.open(io.BytesIO(contents)).convert('RGB')
-    image = image.resize((512, 512))
+    contents = await read_upload(file)
+    if contents is None:
+        ANALYZE_REJECTED.labels(reason="upload_too_large").inc()
+        return upload_too_large()
+    image = await run_in_threadpool(decode_upload, contents)
 
-    # Initialize context for analysis results and tracking
-    context = {}
-    context['user_input'] = {"image_file": file.filename}
-    context['image'] = image
-
-    # Insert mock weather data (replace with real API for production)
-    context['weather'] = {
-        "average_irradiance_kwh_m2_year": 1700,
-        "climate_zone": "Temperate",
-        "sunny_days_per_year": 220
-    }
-
-    # --- Rooftop Detection ---
-    t0 = time.time()
-    with ROOFTOP_LATENCY.time():
-        rooftop_result = detect_and_segment_rooftop(image)
-    perf['rooftop_detection_sec'] = time.time() - t0
-    print(f"[PERF] Rooftop detection: {perf['rooftop_detection_sec']:.3f}s")
-    logger.info(f"Rooftop detection: {perf['rooftop_detection_sec']:.3f}s")
-    # Defensive: handle None or bad output from detection
-    if not rooftop_result or not isinstance(rooftop_result, dict):
-        error_result = {
-            "mask": None,
-            "usable_area_m2": None,
-            "summary": "Rooftop detection failed.",
-            "confidence": 0.0
-        }
-        context['rooftop'] = error_result
-        context['rooftop_validation'] = {
-            'is_valid': False,
-            'validation_msg': 'Rooftop detection failed.',
-            'confidence': 0.0
-        }
-        # Remove raw image from response
-        context_to_return = {k: v for k, v in context.items() if k != 'image'}
-        return JSONResponse(content=context_to_return, status_code=400)
-    # Always propagate the confidence value to the rooftop result for the API response
-    confidence = rooftop_result.get('confidence', 0.0)
-    rooftop_result['confidence'] = confidence
-    context['rooftop'] = rooftop_result
-
-    # --- Rooftop Validation ---
-    t0 = time.time()
-    with VALIDATION_LATENCY.time():
-        is_valid, validation_msg = validate_rooftop_result(rooftop_result)
-        confidence = compute_confidence_score(rooftop_result) if is_valid else 0.0
-    perf['validation_sec'] = time.time() - t0
-    print(f"[PERF] Validation: {perf['validation_sec']:.3f}s")
-    logger.info(f"Validation: {perf['validation_sec']:.3f}s")
-    context['rooftop_validation'] = {
-        'is_valid': is_valid,
-        'validation_msg': validation_msg,
-        'confidence': confidence
-    }
-
-    # --- Shading Analysis ---
-    t0 = time.time()
-    with SHADING_LATENCY.time():
-        shading_map = analyze_shading_and_obstacles(image, rooftop_result)
-    perf['shading_analysis_sec'] = time.time() - t0
-    print(f"[PERF] Shading analysis: {perf['shading_analysis_sec']:.3f}s")
-    logger.info(f"Shading analysis: {perf['shading_analysis_sec']:.3f}s")
-    context['shading'] = shading_map
-
-    # --- Solar Assessment ---
-    t0 = time.time()
-    with ASSESSMENT_LATENCY.time():
-        assessment = assess_solar_potential(context)
-    perf['solar_assessment_sec'] = time.time() - t0
-    print(f"[PERF] Solar assessment: {perf['solar_assessment_sec']:.3f}s")
-    logger.info(f"Solar assessment: {perf['solar_assessment_sec']:.3f}s")
-    context['assessment'] = assessment
-
-    # --- System Recommendation ---
-    t0 = time.time()
-    with RECOMMENDATION_LATENCY.time():
-        recommendation = recommend_system(context)
-    perf['recommendation_sec'] = time.time() - t0
-    print(f"[PERF] System recommendation: {perf['recommendation_sec']:.3f}s")
-    logger.info(f"System recommendation: {perf['recommendation_sec']:.3f}s")
-    context['recommendation'] = recommendation
-
-    # --- ROI Analysis ---
-    t0 = time.time()
-    with ROI_LATENCY.time():
-        roi_report = analyze_cost_and_roi(context)
-    perf['roi_analysis_sec'] = time.time() - t0
-    print(f"[PERF] ROI analysis: {perf['roi_analysis_sec']:.3f}s")
-    logger.info(f"ROI analysis: {perf['roi_analysis_sec']:.3f}s")
-    context['roi'] = roi_report
-
-    # Report path (placeholder, not an actual file)
-    context['report_path'] = "report.pdf"
+    # Run the blocking pipeline off the event loop so admitted requests proceed concurrently
+    context_to_return, status_code = await run_in_threadpool(run_analysis_pipeline, image, file.filename, start_time)
 
     # --- Performance Metrics ---
     duration = time.time() - start_time
     logger.info(f"/analyze processed in {duration:.3f} seconds for file {file.filename}")
     print(f"[PERF] /analyze processed in {duration:.3f} seconds for file {file.filename}")
-    ANALYZE_LATENCY.observe(duration)
-    perf['total_analysis_sec'] = duration
-    context['performance'] = perf
+    if status_code == 200:
+        ANALYZE_LATENCY.observe(duration)
+    return render_context(context_to_return, request.headers.get("accept"), status_code)
+
+@app.post("/analyze/stream")
+async def analyze_image_stream(file: UploadFile = File(...)):
+    """
+    Same analysis as /analyze, streamed as newline-delimited JSON: one
+    {"stage": ..., "data": ...} event per finished stage, then a final
+    {"stage": "done", "status_code": ..., "data": <full context>} event.
+    """
+    ANALYZE_REQUESTS.inc()
+    start_time = time.time()
+    contents = await read_upload(file)
+    if contents is None:
+        ANALYZE_REJECTED.labels(reason="upload_too_large").inc()
+        return upload_too_large()
+    try:
+        queue_wait = await admission.acquire()
+    except AdmissionRejected as e:
+        ANALYZE_REJECTED.labels(reason="at_capacity").inc()
+        return rejection_response(e.status_code, e.detail, e.retry_after)
+    ANALYZE_QUEUE_WAIT.observe(queue_wait)
+
+    # The pipeline runs to completion in its own thread (even if the client goes away),
+    # so the admission slot is always released; events are handed over through a queue.
+    loop = asyncio.get_running_loop()
+    events = queue.Queue()
+
+    def produce():
+        t0 = time.monotonic()
+        try:
+            image = decode_upload(contents)
+            for stage, value in iter_analysis_pipeline(image, file.filename, start_time):
+                if stage == 'result':
+                    context, status_code = value
+                    events.put({"stage": "done", "status_code": status_code, "data": context})
+                    if status_code == 200:
+                        ANALYZE_LATENCY.observe(time.time() - start_time)
+                else:
+                    events.put({"stage": stage, "data": value})
+        except Exception as e:
+            logger.exception("Streaming analysis failed")
+            events.put({"stage": "error", "status_code": 500, "data": {"error": str(e)}})
+        finally:
+            loop.call_soon_threadsafe(admission.release, time.monotonic() - t0)
+            events.put(None)
+
+    threading.Thread(target=produce, name="analyze-stream", daemon=True).start()
+
+    def stream():
+        while True:
+            event = events.get()
+            if event is None:
+                return
+            yield dumps_json(event) + b"\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+# --- Incremental re-analysis ---
+@app.post("/analyses/{analysis_id}/reevaluate")
+async def reevaluate(request: Request, analysis_id: str, overrides: dict = Body(..., embed=True)):
+    """Re-quote a prior analysis with new user parameters, recomputing only invalidated stages."""
+    try:
+        # Snapshot copies, hashing and (inline) report rendering are blocking work; keep them off the event loop
+        context = await run_in_threadpool(reevaluate_analysis, analysis_id, overrides)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    if context is None:
+        return JSONResponse(content={"error": "Analysis not found."}, status_code=404)
+    return render_context(context, request.headers.get("accept"))
+
+# --- User feedback ---
+feedback_store = FeedbackStore()
+
+@app.post("/feedback", status_code=201)
+async def submit_feedback(
+    analysis_id: str = Body(...),
+    verdict: str = Body(None),
+    corrected_area_m2: float = Body(None)
+):
+    """
+    Record a user correction for the confidence calibration job. Only analyses
+    this server produced are accepted, so the raw confidence and predicted area
+    always come from the stored result rather than the caller.
+    """
+    # get() deep-copies the stored snapshot (including the image), so run it off the event loop
+    context = await run_in_threadpool(analysis_store.get, analysis_id)
+    if context is None:
+        return JSONResponse(content={"error": "Analysis not found."}, status_code=404)
+    rooftop = context.get('rooftop') or {}
+    raw_confidence = rooftop.get('confidence', 0.0)
+    predicted_area_m2 = rooftop.get('usable_area_m2')
+    try:
+        record = make_feedback_record(
+            raw_confidence,
+            verdict=verdict,
+            predicted_area_m2=predicted_area_m2,
+            corrected_area_m2=corrected_area_m2,
+            analysis_id=analysis_id
+        )
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    await run_in_threadpool(feedback_store.append, record)
+    return {"status": "recorded", "accurate": record["accurate"]}
+
+# --- Asynchronous job API ---
+# The queue and worker pool are created on first use so importing the app stays cheap.
+_job_queue = None
+_job_pool = None
+
+def run_job(job):
+    """Worker handler: run the unchanged analysis pipeline on a queued upload."""
+    image = decode_upload(job["payload"])
+    return run_analysis_pipeline(image, job["filename"])
+
+def get_job_queue():
+    global _job_queue, _job_pool
+    if _job_queue is None:
+        _job_queue = JobQueue(os.environ.get("JOB_DB_PATH", "jobs.db"))
+        _job_pool = JobWorkerPool(_job_queue, run_job, num_workers=int(os.environ.get("JOB_WORKERS", "2")))
+        _job_pool.start()
+    return _job_queue
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    file: UploadFile = File(...),
+    priority: str = Form("homeowner"),
+    webhook_url: str = Form(None)
+):
+    if priority not in PRIORITY_CLASSES:
+        return JSONResponse(
+            content={"error": f"Unknown priority '{priority}'. Expected one of: {', '.join(PRIORITY_CLASSES)}"},
+            status_code=400
+        )
+    if webhook_url:
+        try:
+            await run_in_threadpool(validate_webhook_url, webhook_url)
+        except ValueError as e:
+            return JSONResponse(content={"error": str(e)}, status_code=400)
+    contents = await read_upload(file)
+    if contents is None:
+        return upload_too_large()
+    job_id = get_job_queue().submit(contents, file.filename, priority, webhook_url)
+    JOBS_SUBMITTED.inc()
+    return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(request: Request, job_id: str):
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return JSONResponse(content={"error": "Job not found."}, status_code=404)
+    return render_context(job, request.headers.get("accept"))
 
-    # Return all context except the raw image object (for serialization safety)
-    context_to_return = {k: v for k, v in context.items() if k != 'image'}
-    return JSONResponse(content=context_to_return)
+# --- Rendered reports ---
+@app.get("/reports/{report_key}")
+async def get_report(report_key: str, format: str = "pdf"):
+    if not report_key.isalnum() or format not in ("pdf", "html"):
+        return JSONResponse(content={"error": "Invalid report request."}, status_code=400)
+    status = report_status(report_key)
+    if status == "ready":
+        media_type = "application/pdf" if format == "pdf" else "text/html"
+        return FileResponse(report_paths(report_key)[format], media_type=media_type)
+    if status == "rendering":
+        return JSONResponse(content={"status": "rendering"}, status_code=202, headers={"Retry-After": "1"})
+    if status == "failed":
+        return JSONResponse(content={"error": "Report rendering failed."}, status_code=500)
+    return JSONResponse(content={"error": "Report not found."}, status_code=404)
@@ -0,0 +1,86 @@
+# Benchmark: serialize time and payload size of analysis contexts per response format
+#
+# Compares the current JSONResponse path with orjson and the compact msgpack format
+# on a realistic context (current fields) and an enlarged one with a 512x512 shading
+# mask, per-panel layouts and hourly production arrays.
+#
+# Usage: python benchmarks/bench_serialization.py [--repeat N]
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse
+
+import serialization
+
+
+def base_context():
+    return {
+        "user_input": {"image_file": "roof.png"},
+        "weather": {"average_irradiance_kwh_m2_year": 1700, "climate_zone": "Temperate", "sunny_days_per_year": 220},
+        "rooftop": {
+            "mask": "POLYGON((100,100),(400,100),(400,400),(100,400))",
+            "usable_area_m2": 42.3,
+            "summary": "Rooftop area detected and segmented.",
+            "confidence": 0.91
+        },
+        "rooftop_validation": {"is_valid": True, "validation_msg": "Valid rooftop result.", "confidence": 0.91},
+        "assessment": {"usable_area_m2": 42.3, "layout_options": [{"panel_count": 21, "orientation": "south", "tilt": 20}]},
+        "recommendation": {"panel_type": "Monocrystalline 400W", "num_panels": 21, "layout": [{"x": 10, "y": 20, "width": 1, "height": 2}]},
+        "roi": {"cost_usd": 10500, "estimated_annual_savings_usd": 1600, "roi_percent": 17.8, "payback_period_years": 5.6},
+    }
+
+
+def large_context():
+    rng = random.Random(0)
+    context = base_context()
+    # Rectangular roof with a few obstacles: long runs, as real segmentation masks have
+    mask = [[1 if 100 <= x < 400 and 100 <= y < 400 else 0 for x in range(512)] for y in range(512)]
+    for cx, cy in ((150, 150), (300, 320), (350, 180)):
+        for y in range(cy - 10, cy + 10):
+            for x in range(cx - 10, cx + 10):
+                mask[y][x] = 0
+    context["shading"] = {
+        "shade_mask": mask,
+        "hourly_irradiance_w_m2": [round(max(0.0, 900 * rng.random()), 2) for _ in range(8760)],
+    }
+    context["recommendation"]["layout"] = [
+        {"x": 100 + 20 * (i % 15), "y": 100 + 40 * (i // 15), "width": 1, "height": 2, "hourly_kwh": [round(0.4 * rng.random(), 3) for _ in range(24)]}
+        for i in range(105)
+    ]
+    return context
+
+
+def time_call(func, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def run(repeat):
+    encoders = [("JSONResponse (current)", lambda c: JSONResponse(content=c).body)]
+    if serialization.orjson is not None:
+        encoders.append(("orjson", serialization.dumps_json))
+    if serialization.msgpack is not None:
+        encoders.append(("msgpack (compact)", serialization.dumps_msgpack))
+
+    for name, context in (("current context", base_context()), ("large context", large_context())):
+        print(f"\n{name}")
+        print(f"{'format':<26}{'serialize (ms)':>16}{'bytes':>12}")
+        for encoder_name, encode in encoders:
+            seconds, body = time_call(lambda: encode(context), repeat)
+            print(f"{encoder_name:<26}{seconds * 1000:>16.3f}{len(body):>12,}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark analysis context serialization")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per measurement (best is reported)")
+    run(parser.parse_args().repeat)
@@ -0,0 +1,82 @@
+# Benchmark: cold-start import cost of the entry points, measured with `python -X importtime`
+#
+# Each entry point is imported in a fresh interpreter (MOCK_VISION_AI=1) several times;
+# the best cumulative import time is compared against a budget, and modules that must
+# stay lazy (openai, requests) are checked to be absent after import.
+#
+# Usage: python benchmarks/bench_startup.py [--repeat N] [--budget-ms module=ms ...]
+# Exits non-zero if any entry point is over budget or eagerly imports a lazy dependency.
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cumulative import budgets in milliseconds. app is dominated by fastapi itself.
+DEFAULT_BUDGETS_MS = {
+    "main": 250,
+    "app": 1500,
+}
+
+# Dependencies that must only load on first use
+LAZY_MODULES = ("openai", "requests")
+
+
+def parse_importtime(stderr):
+    """
+    Parse `-X importtime` output.
+    Returns:
+        Dict of module name -> (self_us, cumulative_us)
+    """
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def measure(module):
+    code = f"import sys, {module}; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    env = dict(os.environ, MOCK_VISION_AI="1", PYTHONDONTWRITEBYTECODE="1")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    timings = parse_importtime(result.stderr)
+    loaded_lazy = [m for m in result.stdout.strip().split(",") if m]
+    return timings, loaded_lazy
+
+
+def run(repeat, budgets):
+    failed = False
+    for module, budget_ms in budgets.items():
+        best_ms, best_timings, loaded_lazy = None, None, []
+        for _ in range(repeat):
+            timings, loaded_lazy = measure(module)
+            total_ms = timings[module][1] / 1000.0
+            if best_ms is None or total_ms < best_ms:
+                best_ms, best_timings = total_ms, timings
+        status = "OK" if best_ms <= budget_ms else "OVER BUDGET"
+        print(f"\n{module}: {best_ms:.1f} ms (budget {budget_ms} ms) {status}")
+        heaviest = sorted(best_timings.items(), key=lambda item: item[1][0], reverse=True)[:8]
+        for name, (self_us, cumulative_us) in heaviest:
+            print(f"  {name:<40}{self_us / 1000.0:>8.1f} ms self{cumulative_us / 1000.0:>10.1f} ms cumulative")
+        if loaded_lazy:
+            print(f"  eagerly imported lazy dependencies: {', '.join(loaded_lazy)}")
+        failed = failed or best_ms > budget_ms or bool(loaded_lazy)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark entry point import time")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per entry point (best is reported)")
+    parser.add_argument("--budget-ms", nargs="*", default=[], help="Override budgets, e.g. main=200 app=1200")
+    args = parser.parse_args()
+    budgets = dict(DEFAULT_BUDGETS_MS)
+    for item in args.budget_ms:
+        module, ms = item.split("=")
+        budgets[module] = float(ms)
+    sys.exit(run(args.repeat, budgets))
@@ -0,0 +1,170 @@
+# Calibration of Vision AI confidence scores against user feedback
+import argparse
+import json
+import os
+import threading
+import time
+
+from user_feedback import FeedbackStore
+
+CALIBRATION_PATH = os.environ.get("CALIBRATION_PATH", "calibration.json")
+
+# Lookup table resolution: raw confidence is bucketed to 0.01
+CALIBRATION_BINS = 101
+
+# Do not replace the identity mapping until there is enough feedback to trust a fit
+MIN_SAMPLES = 50
+
+
+def fit_isotonic(confidences, outcomes):
+    """
+    Fit a non-decreasing mapping from raw confidence to observed accuracy with
+    the pool-adjacent-violators algorithm (O(n) after sorting).
+    Returns:
+        List of (upper_confidence, calibrated_value) steps, ascending
+    """
+    # Records sharing a confidence form one block, so ties are averaged rather than ordered by outcome
+    grouped = {}
+    for confidence, outcome in zip(confidences, outcomes):
+        total, count = grouped.get(confidence, (0.0, 0))
+        grouped[confidence] = (total + float(outcome), count + 1)
+    # Each block: [sum of outcomes, count, max confidence in block]
+    blocks = []
+    for confidence in sorted(grouped):
+        total, count = grouped[confidence]
+        blocks.append([total, count, confidence])
+        while len(blocks) > 1 and blocks[-2][0] / blocks[-2][1] > blocks[-1][0] / blocks[-1][1]:
+            total, count, upper = blocks.pop()
+            blocks[-1][0] += total
+            blocks[-1][1] += count
+            blocks[-1][2] = upper
+    return [(upper, total / count) for total, count, upper in blocks]
+
+
+def build_lookup_table(steps, bins=CALIBRATION_BINS):
+    """Expand isotonic steps into a table indexed by round(raw_confidence * (bins - 1))."""
+    table = []
+    step = 0
+    for i in range(bins):
+        confidence = i / (bins - 1)
+        while step < len(steps) - 1 and confidence > steps[step][0]:
+            step += 1
+        table.append(round(steps[step][1], 4))
+    return table
+
+
+def fit_calibration(records, min_samples=MIN_SAMPLES):
+    """
+    Fit a calibration mapping from feedback records. Only the latest record per
+    analysis_id counts, so resubmitting feedback for one analysis cannot outweigh others.
+    Returns:
+        Dict with table, base_rate, samples and fitted_at, or None if there is too little feedback
+    """
+    latest = {}
+    unattributed = []
+    for record in records:
+        if record.get("analysis_id"):
+            # The store is append-only in time order, so later records replace earlier ones
+            latest[record["analysis_id"]] = record
+        else:
+            unattributed.append(record)
+    confidences, outcomes = [], []
+    for record in unattributed + list(latest.values()):
+        confidences.append(float(record["raw_confidence"]))
+        outcomes.append(1.0 if record["accurate"] else 0.0)
+    if len(confidences) < min_samples:
+        return None
+    return {
+        "table": build_lookup_table(fit_isotonic(confidences, outcomes)),
+        "base_rate": round(sum(outcomes) / len(outcomes), 4),
+        "samples": len(confidences),
+        "fitted_at": time.time()
+    }
+
+
+def save_calibration(calibration, path=None):
+    path = path or CALIBRATION_PATH
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(calibration, f)
+    os.replace(tmp_path, path)
+
+
+# --- In-memory mapping used on the request path ---
+_calibration = None
+
+
+def load_calibration(path=None):
+    """Load a fitted mapping into memory (no-op if the file does not exist). Returns it or None."""
+    global _calibration
+    path = path or CALIBRATION_PATH
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        calibration = json.load(f)
+    if len(calibration.get("table", [])) != CALIBRATION_BINS:
+        print(f"Ignoring calibration file with unexpected table size: {path}")
+        return None
+    _calibration = calibration
+    return calibration
+
+
+def set_calibration(calibration):
+    """Install a mapping directly (or None to go back to raw scores)."""
+    global _calibration
+    _calibration = calibration
+
+
+def calibrate(raw_confidence):
+    """O(1) lookup of the calibrated confidence; returns the raw value when no mapping is loaded."""
+    if _calibration is None:
+        return raw_confidence
+    index = int(round(min(max(raw_confidence, 0.0), 1.0) * (CALIBRATION_BINS - 1)))
+    return _calibration["table"][index]
+
+
+def base_rate():
+    """Observed accuracy across all feedback, or None when no mapping is loaded."""
+    return _calibration["base_rate"] if _calibration is not None else None
+
+
+def run_calibration_job(feedback_path=None, calibration_path=None, min_samples=MIN_SAMPLES):
+    """
+    Refit from the feedback store, save the mapping and load it into memory.
+    Returns:
+        The new calibration, or None if there was not enough feedback
+    """
+    calibration = fit_calibration(FeedbackStore(feedback_path).iter_records(), min_samples)
+    if calibration is None:
+        return None
+    save_calibration(calibration, calibration_path)
+    set_calibration(calibration)
+    print(f"Calibration refit from {calibration['samples']} feedback records (base rate {calibration['base_rate']:.2f})")
+    return calibration
+
+
+def start_periodic_calibration(interval_sec, feedback_path=None, calibration_path=None):
+    """Load any saved mapping, then refit every `interval_sec` seconds in a daemon thread."""
+    load_calibration(calibration_path)
+
+    def loop():
+        while True:
+            time.sleep(interval_sec)
+            try:
+                run_calibration_job(feedback_path, calibration_path)
+            except Exception as e:
+                print(f"Calibration job failed: {e}")
+
+    thread = threading.Thread(target=loop, name="calibration", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit confidence calibration from user feedback")
+    parser.add_argument('--feedback', type=str, default=None, help='Feedback JSONL path (default: FEEDBACK_PATH)')
+    parser.add_argument('--out', type=str, default=None, help='Calibration output path (default: CALIBRATION_PATH)')
+    parser.add_argument('--min_samples', type=int, default=MIN_SAMPLES, help='Minimum feedback records required')
+    args = parser.parse_args()
+    if run_calibration_job(args.feedback, args.out, args.min_samples) is None:
+        print("Not enough feedback to fit a calibration.")
@@ -1,16 +1,63 @@
 # Handles cost and ROI analysis
+import math
+
+# Fraction of nameplate output delivered after inverter, wiring and temperature losses
+PERFORMANCE_RATIO = 0.8
+
+def loan_monthly_payment(principal, annual_rate, term_years):
+    """Fixed monthly payment for an amortizing loan."""
+    months = int(term_years * 12)
+    if months <= 0:
+        return 0.0
+    monthly_rate = annual_rate / 12.0
+    if monthly_rate == 0:
+        return principal / months
+    return principal * monthly_rate / (1 - (1 + monthly_rate) ** -months)
+
+FINANCING_TYPES = ("cash", "loan")
+
+def _require_number(name, value, minimum=0.0, maximum=None):
+    # bool is an int subclass but never a meaningful price or rate
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{name} must be a number.")
+    if not math.isfinite(value):
+        raise ValueError(f"{name} must be finite.")
+    if value < minimum or (maximum is not None and value > maximum):
+        bounds = f"between {minimum} and {maximum}" if maximum is not None else f"at least {minimum}"
+        raise ValueError(f"{name} must be {bounds}.")
+
+def validate_roi_parameters(parameters):
+    """
+    Check the types and ranges of the cost/ROI parameters analyze_cost_and_roi reads.
+    Raises ValueError describing the first invalid value.
+    """
+    if 'price_per_panel_usd' in parameters:
+        _require_number('price_per_panel_usd', parameters['price_per_panel_usd'])
+    if 'tariff_usd_per_kwh' in parameters:
+        _require_number('tariff_usd_per_kwh', parameters['tariff_usd_per_kwh'])
+    if 'financing' in parameters:
+        financing = parameters['financing']
+        if not isinstance(financing, dict) or financing.get('type') not in FINANCING_TYPES:
+            raise ValueError(f"financing must be an object with type one of: {', '.join(FINANCING_TYPES)}")
+        if 'annual_rate' in financing:
+            _require_number('financing.annual_rate', financing['annual_rate'], maximum=1.0)
+        if 'term_years' in financing:
+            _require_number('financing.term_years', financing['term_years'], minimum=1, maximum=50)
 
 def analyze_cost_and_roi(context):
     """
     Estimate installation cost, incentives, payback period, ROI, and savings using context.
+    Optional context['parameters'] keys: price_per_panel_usd, tariff_usd_per_kwh,
+    and financing ({"type": "loan", "annual_rate": 0.06, "term_years": 10}).
     Args:
         context: Dict with all workflow data
     Returns:
         roi_report: Dict with cost and ROI estimates
     """
     recommendation = context.get('recommendation', {})
+    parameters = context.get('parameters', {})
     num_panels = recommendation.get('num_panels', 0)
-    cost = num_panels * 500  # Example: $500 per panel
+    cost = num_panels * parameters.get('price_per_panel_usd', 500)  # Example: $500 per panel
     roi_report = {
         "cost_usd": cost,
         "estimated_annual_savings_usd": 1600,
@@ -18,4 +65,29 @@ def analyze_cost_and_roi(context):
         "payback_period_years": 5.6,
         "incentives_usd": 2000
     }
+
+    tariff = parameters.get('tariff_usd_per_kwh')
+    if tariff is not None:
+        # Irradiance in kWh/m^2/year equals peak-sun-hours per year for a 1 kW/m^2 rated panel
+        irradiance = context.get('weather', {}).get('average_irradiance_kwh_m2_year', 0)
+        annual_kwh = recommendation.get('system_size_kw', 0) * irradiance * PERFORMANCE_RATIO
+        roi_report["estimated_annual_production_kwh"] = round(annual_kwh, 1)
+        roi_report["estimated_annual_savings_usd"] = round(annual_kwh * tariff, 2)
+
+    if tariff is not None or 'price_per_panel_usd' in parameters:
+        # Re-derive ROI and payback so they stay consistent with the quoted cost and savings
+        savings = roi_report["estimated_annual_savings_usd"]
+        net_cost = max(cost - roi_report["incentives_usd"], 0)
+        roi_report["roi_percent"] = round(savings / net_cost * 100, 1) if net_cost else None
+        roi_report["payback_period_years"] = round(net_cost / savings, 1) if savings else None
+
+    financing = parameters.get('financing')
+    if financing and financing.get('type') == 'loan':
+        principal = max(cost - roi_report["incentives_usd"], 0)
+        monthly = loan_monthly_payment(principal, financing.get('annual_rate', 0.0), financing.get('term_years', 10))
+        roi_report["financing"] = {
+            "type": "loan",
+            "monthly_payment_usd": round(monthly, 2),
+            "annual_net_savings_usd": round(roi_report["estimated_annual_savings_usd"] - monthly * 12, 2)
+        }
     return roi_report
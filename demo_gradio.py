@@ -1,83 +1,176 @@
 import gradio as gr
 import requests
-from PIL import Image
+from requests.adapters import HTTPAdapter
+from PIL import Image, features
 import io
+import os
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def analyze_image_gradio(image):
+API_URL = os.environ.get("SOLAR_API_URL", "http://localhost:8000")
+
+# Concurrent analyses in batch mode (kept within the backend's in-flight/rate limits)
+BATCH_CONCURRENCY = int(os.environ.get("DEMO_BATCH_CONCURRENCY", "4"))
+
+# The backend analyzes 512x512 images, so uploads are downscaled and sent as WebP/JPEG
+UPLOAD_SIZE = (512, 512)
+UPLOAD_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+UPLOAD_QUALITY = 85
+
+# One pooled keep-alive session shared by every click and batch worker
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=BATCH_CONCURRENCY))
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=BATCH_CONCURRENCY))
+
+def encode_upload(image):
+    """Downscale and compress an image for upload. Returns (filename, bytes, mime type)."""
+    image = image.convert('RGB')
+    image.thumbnail(UPLOAD_SIZE)
     buf = io.BytesIO()
-    image.save(buf, format='PNG')
-    buf.seek(0)
-    files = {'file': ('upload.png', buf, 'image/png')}
+    image.save(buf, format=UPLOAD_FORMAT, quality=UPLOAD_QUALITY)
+    ext = UPLOAD_FORMAT.lower()
+    return (f"upload.{ext}", buf.getvalue(), f"image/{ext}")
+
+def post_with_retry(path, files, stream=False, attempts=3):
+    """POST to the backend, honoring Retry-After on 429/503 responses."""
+    for attempt in range(attempts):
+        response = session.post(f"{API_URL}{path}", files=files, stream=stream, timeout=120)
+        if response.status_code not in (429, 503) or attempt == attempts - 1:
+            return response
+        response.close()
+        time.sleep(float(response.headers.get("Retry-After", "1")))
+    return response
+
+def analyze_image_gradio(image):
+    """Stream an analysis, filling in each panel as its stage finishes on the backend."""
+    outputs = ["Analyzing..."] + [""] * 7 + [image]
+    yield tuple(outputs)
+    try:
+        response = post_with_retry('/analyze/stream', {'file': encode_upload(image)}, stream=True)
+        if response.status_code != 200:
+            yield ("Error: " + response.text,) + ("",) * 7 + (image,)
+            return
+        for line in response.iter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            stage, data = event.get('stage'), event.get('data')
+            if stage == 'rooftop':
+                outputs[0] = data.get('summary', 'No summary')
+                outputs[1] = data.get('confidence', 'N/A')
+            elif stage == 'rooftop_validation':
+                outputs[2] = data.get('confidence', 'N/A')
+                outputs[3] = data.get('validation_msg', 'N/A')
+            elif stage == 'assessment':
+                outputs[4] = json.dumps(data, indent=2)
+            elif stage == 'recommendation':
+                outputs[5] = json.dumps(data, indent=2)
+            elif stage == 'roi':
+                outputs[6] = json.dumps(data, indent=2)
+            elif stage == 'done':
+                outputs[7] = json.dumps(data, indent=2)
+                if event.get('status_code') != 200:
+                    outputs[0] = data.get('rooftop', {}).get('summary', 'Analysis failed.')
+            elif stage == 'error':
+                outputs[0] = f"Error: {data.get('error')}"
+            yield tuple(outputs)
+    except Exception as e:
+        yield (f"Exception: {e}",) + ("",) * 7 + (image,)
+
+def analyze_one(path):
+    """Run one non-streamed analysis for batch mode. Returns (row, result or None)."""
+    name = os.path.basename(path)
     try:
-        response = requests.post('http://localhost:8000/analyze', files=files)
-        if response.status_code == 200:
-            result = response.json()
-            rooftop = result.get('rooftop', {})
-            validation = result.get('rooftop_validation', {})
-            assessment = result.get('assessment', {})
-            recommendation = result.get('recommendation', {})
-            roi = result.get('roi', {})
-            summary = rooftop.get('summary', 'No summary')
-            conf = rooftop.get('confidence', 'N/A')
-            valid_conf = validation.get('confidence', 'N/A')
-            validation_msg = validation.get('validation_msg', 'N/A')
-            assessment_str = json.dumps(assessment, indent=2)
-            recommendation_str = json.dumps(recommendation, indent=2)
-            roi_str = json.dumps(roi, indent=2)
-            pretty_json = json.dumps(result, indent=2)
-            return (
-                summary,
-                conf,
-                valid_conf,
-                validation_msg,
-                assessment_str,
-                recommendation_str,
-                roi_str,
-                pretty_json,
-                image
-            )
-        else:
-            return ("Error: " + response.text,) + ("",) * 7 + (image,)
+        with Image.open(path) as image:
+            upload = encode_upload(image)
+        t0 = time.time()
+        response = post_with_retry('/analyze', {'file': upload})
+        elapsed = round(time.time() - t0, 2)
+        if response.status_code != 200:
+            return [name, f"HTTP {response.status_code}", "", "", "", elapsed], None
+        result = response.json()
+        rooftop = result.get('rooftop', {})
+        roi = result.get('roi', {})
+        row = [
+            name, "ok", rooftop.get('usable_area_m2'), result.get('rooftop_validation', {}).get('confidence'),
+            roi.get('cost_usd'), elapsed
+        ]
+        return row, result
     except Exception as e:
-        return (f"Exception: {e}",) + ("",) * 7 + (image,)
+        return [name, f"Exception: {e}", "", "", "", ""], None
+
+def analyze_batch(files):
+    """Analyze many images concurrently over the shared session, updating the table as each completes."""
+    if not files:
+        yield [], [], "No files selected."
+        return
+    paths = [f if isinstance(f, str) else f.name for f in files]
+    rows, gallery = [], []
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY) as pool:
+        futures = {pool.submit(analyze_one, path): path for path in paths}
+        for future in as_completed(futures):
+            row, result = future.result()
+            rows.append(row)
+            if result is not None:
+                gallery.append((futures[future], f"{row[0]}: {row[2]} m^2"))
+            status = f"{len(rows)}/{len(paths)} done in {time.time() - t0:.1f}s"
+            yield rows, gallery, status
 
 with gr.Blocks(title="Solar Rooftop Analysis Demo") as demo:
-    gr.Markdown("""
+    gr.Markdown(f"""
     # Solar Rooftop Analysis Demo
-    Upload a rooftop image to get AI-powered analysis and dynamic confidence scores. Backend must be running on localhost:8000.
+    Upload a rooftop image to get AI-powered analysis and dynamic confidence scores. Backend must be running on {API_URL}.
     """)
-    with gr.Row():
-        with gr.Column():
-            img_input = gr.Image(type="pil", label="Upload Rooftop Image")
-            submit_btn = gr.Button("Analyze")
-        with gr.Column():
-            gr.Markdown("## Analysis Summary")
-            summary_out = gr.Textbox(label="Summary", interactive=False)
-            conf_out = gr.Textbox(label="Vision AI Confidence", interactive=False)
-            valid_conf_out = gr.Textbox(label="Validated Confidence", interactive=False)
-            validation_msg_out = gr.Textbox(label="Validation Message", interactive=False)
-    with gr.Row():
-        with gr.Column():
-            gr.Markdown("### Assessment")
-            assessment_out = gr.Textbox(label="Assessment", lines=4, interactive=False)
-        with gr.Column():
-            gr.Markdown("### Recommendation")
-            recommendation_out = gr.Textbox(label="Recommendation", lines=4, interactive=False)
-        with gr.Column():
-            gr.Markdown("### ROI / Cost Analysis")
-            roi_out = gr.Textbox(label="ROI / Cost Analysis", lines=4, interactive=False)
-    with gr.Row():
-        gr.Markdown("### Input Image")
-        img_out = gr.Image(label="Input Image", interactive=False)
-    with gr.Accordion("Full API JSON Response", open=False):
-        json_out = gr.Textbox(label="Full API JSON", lines=16, show_copy_button=True, interactive=False)
-    submit_btn.click(
-        analyze_image_gradio,
-        inputs=img_input,
-        outputs=[summary_out, conf_out, valid_conf_out, validation_msg_out, assessment_out, recommendation_out, roi_out, json_out, img_out],
-        api_name="analyze_image_gradio"
-    )
+    with gr.Tab("Single image"):
+        with gr.Row():
+            with gr.Column():
+                img_input = gr.Image(type="pil", label="Upload Rooftop Image")
+                submit_btn = gr.Button("Analyze")
+            with gr.Column():
+                gr.Markdown("## Analysis Summary")
+                summary_out = gr.Textbox(label="Summary", interactive=False)
+                conf_out = gr.Textbox(label="Vision AI Confidence", interactive=False)
+                valid_conf_out = gr.Textbox(label="Validated Confidence", interactive=False)
+                validation_msg_out = gr.Textbox(label="Validation Message", interactive=False)
+        with gr.Row():
+            with gr.Column():
+                gr.Markdown("### Assessment")
+                assessment_out = gr.Textbox(label="Assessment", lines=4, interactive=False)
+            with gr.Column():
+                gr.Markdown("### Recommendation")
+                recommendation_out = gr.Textbox(label="Recommendation", lines=4, interactive=False)
+            with gr.Column():
+                gr.Markdown("### ROI / Cost Analysis")
+                roi_out = gr.Textbox(label="ROI / Cost Analysis", lines=4, interactive=False)
+        with gr.Row():
+            gr.Markdown("### Input Image")
+            img_out = gr.Image(label="Input Image", interactive=False)
+        with gr.Accordion("Full API JSON Response", open=False):
+            json_out = gr.Textbox(label="Full API JSON", lines=16, show_copy_button=True, interactive=False)
+        submit_btn.click(
+            analyze_image_gradio,
+            inputs=img_input,
+            outputs=[summary_out, conf_out, valid_conf_out, validation_msg_out, assessment_out, recommendation_out, roi_out, json_out, img_out],
+            api_name="analyze_image_gradio"
+        )
+    with gr.Tab("Batch / gallery"):
+        gr.Markdown(f"Analyze several rooftop images at once ({BATCH_CONCURRENCY} concurrent requests).")
+        batch_input = gr.File(file_count="multiple", file_types=["image"], label="Rooftop Images")
+        batch_btn = gr.Button("Analyze All")
+        batch_status = gr.Textbox(label="Progress", interactive=False)
+        batch_table = gr.Dataframe(
+            headers=["File", "Status", "Usable Area (m^2)", "Validated Confidence", "Cost (USD)", "Latency (s)"],
+            interactive=False
+        )
+        batch_gallery = gr.Gallery(label="Analyzed Rooftops", columns=4)
+        batch_btn.click(
+            analyze_batch,
+            inputs=batch_input,
+            outputs=[batch_table, batch_gallery, batch_status],
+            api_name="analyze_batch"
+        )
 
 if __name__ == "__main__":
     demo.launch()
@@ -1,6 +1,5 @@
 # Handles image acquisition and preprocessing
 
-import requests
 from PIL import Image
 from io import BytesIO
 import os
@@ -30,6 +29,7 @@ def fetch_and_preprocess_image(user_input):
         API_KEY = "YOUR_MAPBOX_API_KEY"  # <-- Replace with your real API key
         url = f"https://api.mapbox.com/styles/v1/mapbox/satellite-v9/static/{address}/auto/512x512?access_token={API_KEY}"
         try:
+            import requests  # Only needed for remote fetches; keeps local-image runs fast
             response = requests.get(url)
             response.raise_for_status()
             image = Image.open(BytesIO(response.content))
@@ -44,3 +44,24 @@ def fetch_and_preprocess_image(user_input):
     # Example preprocessing: resize, convert to RGB
     image = image.convert('RGB').resize((512, 512))
     return image
+
+def fetch_satellite_tile(z, x, y):
+    """
+    Fetch one 512x512 satellite tile (Web Mercator / slippy-map z/x/y) from Mapbox.
+    Requires MAPBOX_API_KEY in the environment.
+    Returns:
+        image: PIL.Image (RGB), or None on failure
+    """
+    api_key = os.environ.get("MAPBOX_API_KEY")
+    if not api_key:
+        print("MAPBOX_API_KEY not set in environment or .env file.")
+        return None
+    url = f"https://api.mapbox.com/v4/mapbox.satellite/{z}/{x}/{y}@2x.jpg90?access_token={api_key}"
+    try:
+        import requests
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        return Image.open(BytesIO(response.content)).convert('RGB')
+    except Exception as e:
+        print(f"Error fetching satellite tile {z}/{x}/{y}: {e}")
+        return None
@@ -0,0 +1,284 @@
+# Persistent job queue (SQLite-backed) and local worker pool for long-running analyses
+import ipaddress
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+import logging
+
+logger = logging.getLogger("performance")
+
+# Lower value = served first. Homeowner requests go ahead of bulk portfolio jobs.
+PRIORITY_CLASSES = {
+    "homeowner": 0,
+    "professional": 1,
+    "portfolio": 2
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    priority INTEGER NOT NULL,
+    priority_class TEXT NOT NULL,
+    status TEXT NOT NULL,
+    filename TEXT,
+    payload BLOB,
+    webhook_url TEXT,
+    result TEXT,
+    status_code INTEGER,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_queued ON jobs (status, priority, created_at);
+"""
+
+# Optional comma-separated host allowlist for webhook URLs (empty = any public host)
+WEBHOOK_ALLOWED_HOSTS = {h.strip().lower() for h in os.environ.get("WEBHOOK_ALLOWED_HOSTS", "").split(",") if h.strip()}
+
+# A 'running' job older than this is presumed abandoned by a dead process and may be requeued
+JOB_LEASE_TIMEOUT_SEC = float(os.environ.get("JOB_LEASE_TIMEOUT_SEC", "900"))
+
+
+class JobQueue:
+    """
+    Durable FIFO-per-priority queue of analysis jobs stored in SQLite.
+    Queued jobs survive restarts; jobs left 'running' by a crashed worker are
+    put back on the queue by requeue_interrupted() once their lease expires.
+    Several processes may share one database: claims are a conditional UPDATE,
+    so each job is claimed exactly once.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def submit(self, payload, filename, priority_class="homeowner", webhook_url=None):
+        """
+        Enqueue raw upload bytes for analysis.
+        Returns:
+            job_id: Identifier to poll with get()
+        """
+        if priority_class not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority class: {priority_class}")
+        job_id = uuid.uuid4().hex
+        with self._not_empty:
+            self._conn.execute(
+                "INSERT INTO jobs (id, priority, priority_class, status, filename, payload, webhook_url, created_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, PRIORITY_CLASSES[priority_class], priority_class, filename, payload, webhook_url, time.time())
+            )
+            self._not_empty.notify()
+        return job_id
+
+    def claim_next(self, timeout=None):
+        """
+        Atomically take the highest-priority, oldest queued job and mark it running.
+        Blocks up to `timeout` seconds. Returns a job dict or None.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._not_empty:
+            while True:
+                job = self._try_claim()
+                if job is not None:
+                    return job
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._not_empty.wait(remaining)
+
+    def _try_claim(self):
+        # Another process may claim the same candidate between SELECT and UPDATE;
+        # the status guard makes only one UPDATE succeed, and the loser tries the next job.
+        while True:
+            row = self._conn.execute(
+                "SELECT id, priority_class, filename, payload, webhook_url FROM jobs "
+                "WHERE status = 'queued' ORDER BY priority, created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), row["id"])
+            )
+            if cursor.rowcount == 1:
+                return dict(row)
+
+    def complete(self, job_id, result, status_code=200):
+        """Store the result of a finished job and drop its upload payload."""
+        status = "completed" if status_code < 400 else "failed"
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, status_code = ?, payload = NULL, finished_at = ? WHERE id = ?",
+                (status, json.dumps(result), status_code, time.time(), job_id)
+            )
+
+    def fail(self, job_id, error):
+        """Mark a job as failed because the handler raised."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, status_code = 500, payload = NULL, finished_at = ? WHERE id = ?",
+                (str(error), time.time(), job_id)
+            )
+
+    def get(self, job_id):
+        """
+        Look up a job's status and result.
+        Returns:
+            Dict with job_id, status, priority, timestamps, result and error, or None if unknown
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, priority_class, status, filename, result, status_code, error, "
+                "created_at, started_at, finished_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "job_id": row["id"],
+            "status": row["status"],
+            "priority": row["priority_class"],
+            "filename": row["filename"],
+            "status_code": row["status_code"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"]
+        }
+
+    def requeue_interrupted(self, lease_timeout=None):
+        """
+        Put jobs left 'running' (e.g. by a crashed process) back on the queue.
+        Only jobs started more than `lease_timeout` seconds ago are touched, so
+        jobs still being run by other live processes are left alone.
+        """
+        if lease_timeout is None:
+            lease_timeout = JOB_LEASE_TIMEOUT_SEC
+        with self._not_empty:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running' AND started_at <= ?",
+                (time.time() - lease_timeout,)
+            )
+            self._not_empty.notify_all()
+        return cursor.rowcount
+
+    def depth(self):
+        """Number of jobs waiting to be claimed."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+
+def validate_webhook_url(url):
+    """
+    Reject webhook URLs the server must not call: anything but https, hosts
+    outside WEBHOOK_ALLOWED_HOSTS (when set), and hosts resolving to private,
+    loopback, link-local or otherwise non-public addresses.
+    Raises ValueError.
+    Returns:
+        A validated public IP address for the host, to connect to directly
+    """
+    from urllib.parse import urlsplit
+    parts = urlsplit(url)
+    if parts.scheme != "https" or not parts.hostname:
+        raise ValueError("webhook_url must be an https URL.")
+    host = parts.hostname.lower()
+    if WEBHOOK_ALLOWED_HOSTS and host not in WEBHOOK_ALLOWED_HOSTS:
+        raise ValueError(f"webhook_url host '{host}' is not allowed.")
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or 443, proto=socket.IPPROTO_TCP)}
+    except socket.gaierror:
+        raise ValueError(f"webhook_url host '{host}' does not resolve.")
+    for address in addresses:
+        if not ipaddress.ip_address(address.split("%")[0]).is_global:
+            raise ValueError(f"webhook_url host '{host}' resolves to a non-public address.")
+    return sorted(addresses)[0].split("%")[0]
+
+
+def notify_webhook(url, payload):
+    """
+    POST a finished job to its webhook. Failures are logged, never raised.
+    The host is resolved and checked once, and the connection is pinned to that
+    address (with the original Host header and TLS server name), so a DNS answer
+    that changes after validation cannot redirect delivery to an internal host.
+    """
+    try:
+        import certifi
+        import urllib3
+        from urllib.parse import urlsplit
+        # Re-check at delivery time: DNS may have changed since the job was submitted
+        address = validate_webhook_url(url)
+        parts = urlsplit(url)
+        pool = urllib3.HTTPSConnectionPool(
+            address, port=parts.port or 443,
+            server_hostname=parts.hostname, assert_hostname=parts.hostname,
+            cert_reqs="CERT_REQUIRED", ca_certs=certifi.where(),
+            timeout=10, retries=False
+        )
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        response = pool.urlopen(
+            "POST", path, body=json.dumps(payload).encode("utf-8"), redirect=False,
+            headers={"Host": parts.netloc.rsplit("@", 1)[-1], "Content-Type": "application/json"}
+        )
+        if response.status >= 400:
+            raise RuntimeError(f"HTTP {response.status}")
+    except Exception as e:
+        print(f"Webhook delivery to {url} failed: {e}")
+        logger.warning(f"Webhook delivery to {url} failed: {e}")
+
+
+class JobWorkerPool:
+    """
+    Local pool of worker threads draining a JobQueue.
+    handler(job) must return (result_dict, status_code).
+    """
+
+    def __init__(self, queue, handler, num_workers=2, poll_interval=0.5):
+        self.queue = queue
+        self.handler = handler
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        requeued = self.queue.requeue_interrupted()
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted job(s)")
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            job = self.queue.claim_next(timeout=self.poll_interval)
+            if job is None:
+                continue
+            try:
+                result, status_code = self.handler(job)
+                self.queue.complete(job["id"], result, status_code)
+            except Exception as e:
+                print(f"Job {job['id']} failed: {e}")
+                logger.exception(f"Job {job['id']} failed")
+                self.queue.fail(job["id"], e)
+            if job.get("webhook_url"):
+                notify_webhook(job["webhook_url"], self.queue.get(job["id"]))
@@ -7,15 +7,13 @@ from system_design import recommend_system
 from cost_roi_analysis import analyze_cost_and_roi
 from report_generation import generate_report
 from user_feedback import collect_user_feedback
-from utils import validate_rooftop_result, compute_confidence_score
+from utils import validate_rooftop_result, compute_confidence_score, needs_manual_review
+from calibration import load_calibration
 
 import argparse
 from dotenv import load_dotenv
 import os
 
-# Load environment variables from .env
-load_dotenv()
-
 def fetch_mock_weather(address):
     # Simulate fetching weather/irradiance data for a given address
     return {
@@ -32,10 +30,15 @@ def main():
     logger = logging.getLogger("performance")
     start_time = time.time()
 
+    # Load environment variables from .env
+    load_dotenv()
+
     parser = argparse.ArgumentParser(description="AI Rooftop Solar Analysis")
     parser.add_argument('--address', type=str, help='Address to analyze (for satellite image fetch)')
     parser.add_argument('--image', type=str, help='Path to local rooftop image (optional)')
     parser.add_argument('--user_type', type=str, default='homeowner', help='User type: homeowner or professional')
+    parser.add_argument('--feedback', type=str, choices=['correct', 'incorrect'], help='Record whether the detected rooftop was correct')
+    parser.add_argument('--corrected_area', type=float, help='Record the actual usable rooftop area (m^2)')
     args = parser.parse_args()
 
     context = {}
@@ -59,13 +62,15 @@ def main():
     rooftop_result = detect_and_segment_rooftop(image)
     context['rooftop'] = rooftop_result
 
-    # Validate and score Vision AI output
+    # Validate and score Vision AI output (using the feedback calibration, if fitted)
+    load_calibration()
     is_valid, validation_msg = validate_rooftop_result(rooftop_result)
     confidence = compute_confidence_score(rooftop_result) if is_valid else 0.0
     context['rooftop_validation'] = {
         'is_valid': is_valid,
         'validation_msg': validation_msg,
-        'confidence': confidence
+        'confidence': confidence,
+        'needs_review': not is_valid or needs_manual_review(confidence)
     }
 
     print("\nStructured Vision AI Output:")
@@ -77,8 +82,10 @@ def main():
         print(f"Confidence Score: {confidence:.2f}")
         if not is_valid:
             print("[WARNING] Rooftop output failed validation. Downstream results may be unreliable.")
-        elif confidence < 0.7:
+        elif needs_manual_review(confidence):
             print("[WARNING] Confidence score is low. Please verify the result.")
+        else:
+            print("Calibrated confidence is high; manual review not required.")
     else:
         print("Vision AI did not return a valid result.")
         return
@@ -105,7 +112,7 @@ def main():
     context['report_path'] = report_path
 
     print("8. User Feedback & Iteration...")
-    feedback = collect_user_feedback(report_path)
+    feedback = collect_user_feedback(report_path, context, args.feedback, args.corrected_area)
     context['feedback'] = feedback
     print(f"Feedback: {feedback}")
 
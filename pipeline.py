@@ -0,0 +1,253 @@
+# Shared analysis pipeline used by the /analyze endpoint and the background job workers
+import os
+import time
+import logging
+from prometheus_client import Histogram
+
+from rooftop_detection import detect_and_segment_rooftop
+from shading_analysis import analyze_shading_and_obstacles
+from solar_assessment import assess_solar_potential
+from system_design import PANEL_TYPES, recommend_system
+from cost_roi_analysis import analyze_cost_and_roi, validate_roi_parameters
+from report_generation import submit_report
+from analysis_store import AnalysisStore
+from utils import validate_rooftop_result, compute_confidence_score, needs_manual_review
+
+logger = logging.getLogger("performance")
+
+# Prometheus metrics (per stage)
+ROOFTOP_LATENCY = Histogram('rooftop_detection_latency_seconds', 'Latency for rooftop detection (seconds)')
+VALIDATION_LATENCY = Histogram('validation_latency_seconds', 'Latency for validation (seconds)')
+SHADING_LATENCY = Histogram('shading_analysis_latency_seconds', 'Latency for shading analysis (seconds)')
+ASSESSMENT_LATENCY = Histogram('assessment_latency_seconds', 'Latency for solar assessment (seconds)')
+RECOMMENDATION_LATENCY = Histogram('recommendation_latency_seconds', 'Latency for system recommendation (seconds)')
+ROI_LATENCY = Histogram('roi_latency_seconds', 'Latency for ROI analysis (seconds)')
+REEVALUATE_LATENCY = Histogram('reevaluate_latency_seconds', 'Latency for incremental re-analysis (seconds)')
+
+# Snapshots of completed analyses, keyed by analysis_id, for incremental re-analysis
+analysis_store = AnalysisStore(max_entries=int(os.environ.get("ANALYSIS_STORE_SIZE", "128")))
+
+# Stages that can be recomputed from a stored context, in dependency order.
+# Each stage reads only the context keys written by earlier stages plus context['parameters'].
+DOWNSTREAM_STAGES = [
+    ('assessment', assess_solar_potential),
+    ('recommendation', recommend_system),
+    ('roi', analyze_cost_and_roi),
+]
+
+# First stage that reads each user parameter; it and everything after it are invalidated
+PARAMETER_STAGES = {
+    'panel_type': 'recommendation',
+    'price_per_panel_usd': 'roi',
+    'tariff_usd_per_kwh': 'roi',
+    'financing': 'roi',
+}
+
+
+def fetch_mock_weather():
+    # Insert mock weather data (replace with real API for production)
+    return {
+        "average_irradiance_kwh_m2_year": 1700,
+        "climate_zone": "Temperate",
+        "sunny_days_per_year": 220
+    }
+
+
+def run_analysis_pipeline(image, filename, start_time=None):
+    """
+    Run every analysis stage on a preprocessed 512x512 RGB image.
+    Args:
+        image: Preprocessed PIL.Image object
+        filename: Name of the uploaded file (recorded in user_input)
+        start_time: Optional time.time() value the request started at (defaults to now)
+    Returns:
+        (context, status_code): Serializable context dict (raw image removed) and
+        the HTTP status to report (400 when rooftop detection fails, else 200)
+    """
+    for stage, value in iter_analysis_pipeline(image, filename, start_time):
+        if stage == 'result':
+            return value
+
+
+def iter_analysis_pipeline(image, filename, start_time=None):
+    """
+    Same stages as run_analysis_pipeline, yielding (stage, output) as each one
+    finishes so callers can stream progress. The last event is
+    ('result', (context, status_code)).
+    """
+    if start_time is None:
+        start_time = time.time()
+    perf = {}
+
+    # Initialize context for analysis results and tracking
+    context = {}
+    context['user_input'] = {"image_file": filename}
+    context['image'] = image
+    context['weather'] = fetch_mock_weather()
+    context['parameters'] = {}
+
+    # --- Rooftop Detection ---
+    t0 = time.time()
+    with ROOFTOP_LATENCY.time():
+        rooftop_result = detect_and_segment_rooftop(image)
+    perf['rooftop_detection_sec'] = time.time() - t0
+    print(f"[PERF] Rooftop detection: {perf['rooftop_detection_sec']:.3f}s")
+    logger.info(f"Rooftop detection: {perf['rooftop_detection_sec']:.3f}s")
+    # Defensive: handle None or bad output from detection
+    if not rooftop_result or not isinstance(rooftop_result, dict):
+        error_result = {
+            "mask": None,
+            "usable_area_m2": None,
+            "summary": "Rooftop detection failed.",
+            "confidence": 0.0
+        }
+        context['rooftop'] = error_result
+        context['rooftop_validation'] = {
+            'is_valid': False,
+            'validation_msg': 'Rooftop detection failed.',
+            'confidence': 0.0,
+            'needs_review': True
+        }
+        # Remove raw image from response
+        context_to_return = {k: v for k, v in context.items() if k != 'image'}
+        yield 'result', (context_to_return, 400)
+        return
+    # Always propagate the confidence value to the rooftop result for the API response
+    confidence = rooftop_result.get('confidence', 0.0)
+    rooftop_result['confidence'] = confidence
+    context['rooftop'] = rooftop_result
+    yield 'rooftop', rooftop_result
+
+    # --- Rooftop Validation ---
+    t0 = time.time()
+    with VALIDATION_LATENCY.time():
+        is_valid, validation_msg = validate_rooftop_result(rooftop_result)
+        confidence = compute_confidence_score(rooftop_result) if is_valid else 0.0
+    perf['validation_sec'] = time.time() - t0
+    print(f"[PERF] Validation: {perf['validation_sec']:.3f}s")
+    logger.info(f"Validation: {perf['validation_sec']:.3f}s")
+    context['rooftop_validation'] = {
+        'is_valid': is_valid,
+        'validation_msg': validation_msg,
+        'confidence': confidence,
+        'needs_review': not is_valid or needs_manual_review(confidence)
+    }
+    yield 'rooftop_validation', context['rooftop_validation']
+
+    # --- Shading Analysis ---
+    t0 = time.time()
+    with SHADING_LATENCY.time():
+        shading_map = analyze_shading_and_obstacles(image, rooftop_result)
+    perf['shading_analysis_sec'] = time.time() - t0
+    print(f"[PERF] Shading analysis: {perf['shading_analysis_sec']:.3f}s")
+    logger.info(f"Shading analysis: {perf['shading_analysis_sec']:.3f}s")
+    context['shading'] = shading_map
+    yield 'shading', shading_map
+
+    # --- Solar Assessment ---
+    t0 = time.time()
+    with ASSESSMENT_LATENCY.time():
+        assessment = assess_solar_potential(context)
+    perf['solar_assessment_sec'] = time.time() - t0
+    print(f"[PERF] Solar assessment: {perf['solar_assessment_sec']:.3f}s")
+    logger.info(f"Solar assessment: {perf['solar_assessment_sec']:.3f}s")
+    context['assessment'] = assessment
+    yield 'assessment', assessment
+
+    # --- System Recommendation ---
+    t0 = time.time()
+    with RECOMMENDATION_LATENCY.time():
+        recommendation = recommend_system(context)
+    perf['recommendation_sec'] = time.time() - t0
+    print(f"[PERF] System recommendation: {perf['recommendation_sec']:.3f}s")
+    logger.info(f"System recommendation: {perf['recommendation_sec']:.3f}s")
+    context['recommendation'] = recommendation
+    yield 'recommendation', recommendation
+
+    # --- ROI Analysis ---
+    t0 = time.time()
+    with ROI_LATENCY.time():
+        roi_report = analyze_cost_and_roi(context)
+    perf['roi_analysis_sec'] = time.time() - t0
+    print(f"[PERF] ROI analysis: {perf['roi_analysis_sec']:.3f}s")
+    logger.info(f"ROI analysis: {perf['roi_analysis_sec']:.3f}s")
+    context['roi'] = roi_report
+    yield 'roi', roi_report
+
+    # --- Report Generation (rendered off the request path, cached by content hash) ---
+    report_path, report_key = submit_report(context)
+    context['report_path'] = report_path
+    context['report_url'] = f"/reports/{report_key}"
+    yield 'report', {'report_path': report_path, 'report_url': context['report_url']}
+
+    # --- Performance Metrics ---
+    duration = time.time() - start_time
+    perf['total_analysis_sec'] = duration
+    context['performance'] = perf
+
+    # Snapshot the context so parameter changes can be re-quoted incrementally
+    context['analysis_id'] = analysis_store.put(context)
+
+    # Return all context except the raw image object (for serialization safety)
+    context_to_return = {k: v for k, v in context.items() if k != 'image'}
+    yield 'result', (context_to_return, 200)
+
+
+def invalidated_stages(overrides):
+    """
+    Work out which downstream stages a set of parameter overrides invalidates.
+    Raises ValueError for unknown parameter names or invalid values.
+    Returns:
+        List of stage names (context keys) in execution order
+    """
+    unknown = [name for name in overrides if name not in PARAMETER_STAGES]
+    if unknown:
+        raise ValueError(f"Unknown parameter(s): {', '.join(sorted(unknown))}. Expected: {', '.join(PARAMETER_STAGES)}")
+    if 'panel_type' in overrides and (not isinstance(overrides['panel_type'], str) or overrides['panel_type'] not in PANEL_TYPES):
+        raise ValueError(f"Unknown panel type: {overrides['panel_type']}. Expected one of: {', '.join(PANEL_TYPES)}")
+    validate_roi_parameters(overrides)
+    stage_names = [name for name, _ in DOWNSTREAM_STAGES]
+    if not overrides:
+        return []
+    first = min(stage_names.index(PARAMETER_STAGES[name]) for name in overrides)
+    return stage_names[first:]
+
+
+def reevaluate_analysis(analysis_id, overrides):
+    """
+    Recompute only the stages invalidated by `overrides`, starting from a stored
+    context snapshot (rooftop detection and shading are never rerun).
+    Args:
+        analysis_id: ID returned by a previous analysis
+        overrides: Dict of user parameters to change (see PARAMETER_STAGES)
+    Returns:
+        context: Serializable context with a new analysis_id, or None if the
+        prior analysis is unknown or has been evicted
+    """
+    start_time = time.time()
+    stages = invalidated_stages(overrides)
+    context = analysis_store.get(analysis_id)
+    if context is None:
+        return None
+    context['parameters'] = {**context.get('parameters', {}), **overrides}
+
+    perf = {}
+    stage_funcs = dict(DOWNSTREAM_STAGES)
+    with REEVALUATE_LATENCY.time():
+        for name in stages:
+            t0 = time.time()
+            context[name] = stage_funcs[name](context)
+            perf[f'{name}_sec'] = time.time() - t0
+
+        report_path, report_key = submit_report(context)
+        context['report_path'] = report_path
+        context['report_url'] = f"/reports/{report_key}"
+
+    duration = time.time() - start_time
+    logger.info(f"Re-evaluated {analysis_id} ({', '.join(stages) or 'no stages'}) in {duration:.3f}s")
+    perf['total_analysis_sec'] = duration
+    context['performance'] = perf
+    context['recomputed_stages'] = stages
+    context['parent_analysis_id'] = analysis_id
+    context['analysis_id'] = analysis_store.put(context)
+    return {k: v for k, v in context.items() if k != 'image'}
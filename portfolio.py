@@ -0,0 +1,534 @@
+# Portfolio-scale batch analysis: tile a bounding box (or walk an address list), detect every
+# rooftop, deduplicate buildings split across tile seams, and stream results to GeoJSON/Parquet.
+import argparse
+import hashlib
+import json
+import math
+import os
+import time
+
+from image_acquisition import fetch_and_preprocess_image, fetch_satellite_tile
+from rooftop_detection import detect_and_segment_rooftop, detect_rooftops_in_tile
+from shading_analysis import analyze_shading_and_obstacles
+from solar_assessment import assess_solar_potential
+from system_design import recommend_system
+from cost_roi_analysis import analyze_cost_and_roi
+from pipeline import fetch_mock_weather
+
+# Satellite tiles are fetched at @2x, i.e. 512x512 pixels per slippy-map tile
+TILE_SIZE = 512
+DEFAULT_ZOOM = 19
+
+# A rooftop within this many pixels of a tile border is treated as cut by the seam
+EDGE_MARGIN_PX = 2
+
+# Share of the roof footprint usable for panels when the model gives no estimate
+USABLE_ROOF_FRACTION = 0.6
+
+EARTH_CIRCUMFERENCE_M = 40075016.686
+
+
+# --- Tile math (Web Mercator / slippy-map tiles) ---
+
+def lonlat_to_tile(lon, lat, zoom):
+    """Fractional tile coordinates (x, y) of a point at `zoom`."""
+    n = 2 ** zoom
+    lat_rad = math.radians(lat)
+    x = (lon + 180.0) / 360.0 * n
+    y = (1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n
+    return x, y
+
+
+def tile_pixel_to_lonlat(zoom, x, y, px, py, tile_size=TILE_SIZE):
+    """Longitude/latitude of pixel (px, py) within tile (x, y)."""
+    n = 2 ** zoom
+    gx = x + px / tile_size
+    gy = y + py / tile_size
+    lon = gx / n * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * gy / n))))
+    return lon, lat
+
+
+def meters_per_pixel(lat, zoom, tile_size=TILE_SIZE):
+    """Ground resolution of a tile pixel at latitude `lat`."""
+    return EARTH_CIRCUMFERENCE_M * math.cos(math.radians(lat)) / (2 ** zoom * tile_size)
+
+
+def tile_range(bbox, zoom):
+    """
+    Inclusive tile index ranges covering bbox = (min_lon, min_lat, max_lon, max_lat).
+    Returns:
+        (x_min, x_max, y_min, y_max)
+    """
+    min_lon, min_lat, max_lon, max_lat = bbox
+    if min_lon >= max_lon or min_lat >= max_lat:
+        raise ValueError(f"Invalid bounding box: {bbox}")
+    x0, y0 = lonlat_to_tile(min_lon, max_lat, zoom)  # north-west corner
+    x1, y1 = lonlat_to_tile(max_lon, min_lat, zoom)  # south-east corner
+    return int(x0), int(math.ceil(x1)) - 1, int(y0), int(math.ceil(y1)) - 1
+
+
+def iter_tiles(bbox, zoom):
+    """Yield (x, y) tiles covering bbox in row-major order."""
+    x_min, x_max, y_min, y_max = tile_range(bbox, zoom)
+    for y in range(y_min, y_max + 1):
+        for x in range(x_min, x_max + 1):
+            yield x, y
+
+
+def polygon_area(points):
+    """Shoelace area of a polygon given as [[x, y], ...]."""
+    area = 0.0
+    for (x1, y1), (x2, y2) in zip(points, points[1:] + points[:1]):
+        area += x1 * y2 - x2 * y1
+    return abs(area) / 2.0
+
+
+# --- Per-building stages ---
+
+def evaluate_building(rooftop, shading, weather, parameters):
+    """Run the assessment, recommendation and ROI stages for one detected rooftop."""
+    context = {"rooftop": rooftop, "shading": shading, "weather": weather, "parameters": parameters or {}}
+    context['assessment'] = assess_solar_potential(context)
+    context['recommendation'] = recommend_system(context)
+    context['roi'] = analyze_cost_and_roi(context)
+    return {key: context[key] for key in ("assessment", "recommendation", "roi")}
+
+
+def _tile_seams(x, y):
+    """Seam keys on the left, right, top and bottom borders of tile (x, y)."""
+    return [("v", x, y), ("v", x + 1, y), ("h", x, y), ("h", x, y + 1)]
+
+
+def analyze_tile(zoom, x, y, fetch_tile=fetch_satellite_tile, parameters=None):
+    """
+    Fetch one tile, detect every rooftop on it and run the per-building stages.
+    Runs inside a worker process; returns only small, picklable records.
+    Returns:
+        Dict with tile, buildings (list) and error (None on success)
+    """
+    image = fetch_tile(zoom, x, y)
+    if image is None:
+        return {"tile": (x, y), "buildings": [], "error": "Tile fetch failed."}
+    width, height = image.size
+    weather = fetch_mock_weather()
+    buildings = []
+    for rooftop in detect_rooftops_in_tile(image):
+        polygon = rooftop["polygon"]
+        xs = [p[0] for p in polygon]
+        ys = [p[1] for p in polygon]
+        lonlat = [list(tile_pixel_to_lonlat(zoom, x, y, px * TILE_SIZE / width, py * TILE_SIZE / height)) for px, py in polygon]
+        lons = [p[0] for p in lonlat]
+        lats = [p[1] for p in lonlat]
+        if "usable_area_m2" not in rooftop:
+            mpp = meters_per_pixel(sum(lats) / len(lats), zoom, width)
+            rooftop["usable_area_m2"] = round(polygon_area(polygon) * mpp * mpp * USABLE_ROOF_FRACTION, 1)
+
+        left, right, top, bottom = _tile_seams(x, y)
+        seams = []
+        if min(xs) <= EDGE_MARGIN_PX:
+            seams.append(left)
+        if max(xs) >= width - EDGE_MARGIN_PX:
+            seams.append(right)
+        if min(ys) <= EDGE_MARGIN_PX:
+            seams.append(top)
+        if max(ys) >= height - EDGE_MARGIN_PX:
+            seams.append(bottom)
+
+        shading = analyze_shading_and_obstacles(image, rooftop)
+        building = {
+            "tile": (zoom, x, y),
+            "polygon": lonlat,
+            "bbox": [min(lons), min(lats), max(lons), max(lats)],
+            "seams": seams,
+            "usable_area_m2": rooftop["usable_area_m2"],
+            "confidence": rooftop.get("confidence", 0.0),
+            "shading": shading,
+        }
+        building.update(evaluate_building(rooftop, shading, weather, parameters))
+        buildings.append(building)
+    return {"tile": (x, y), "buildings": buildings, "error": None}
+
+
+# --- Seam deduplication ---
+
+class SeamDeduplicator:
+    """
+    Merges rooftop fragments that were cut by a tile seam into single buildings.
+
+    Buildings away from tile borders are emitted immediately. Fragments touching a
+    seam are held until both tiles sharing that seam have been processed (or the
+    neighbour lies outside the run), then merged with overlapping fragments from
+    the other side. Only fragments on still-open seams are held, so memory stays
+    proportional to the processing frontier rather than the whole run.
+    """
+
+    def __init__(self, x_range, y_range, weather=None, parameters=None):
+        self.x_range = x_range
+        self.y_range = y_range
+        self.weather = weather or fetch_mock_weather()
+        self.parameters = parameters or {}
+        self._done = set()
+        self._fragments = {}
+        self._seam_fragments = {}
+        self._parent = {}
+        self._members = {}
+        self._next_id = 0
+
+    def _in_range(self, tile):
+        x, y = tile
+        return self.x_range[0] <= x <= self.x_range[1] and self.y_range[0] <= y <= self.y_range[1]
+
+    @staticmethod
+    def _seam_tiles(seam):
+        axis, a, b = seam
+        if axis == "v":
+            return (a - 1, b), (a, b)
+        return (a, b - 1), (a, b)
+
+    def _seam_complete(self, seam):
+        return all(tile in self._done or not self._in_range(tile) for tile in self._seam_tiles(seam))
+
+    def _find(self, fragment_id):
+        while self._parent[fragment_id] != fragment_id:
+            self._parent[fragment_id] = self._parent[self._parent[fragment_id]]
+            fragment_id = self._parent[fragment_id]
+        return fragment_id
+
+    def _union(self, a, b):
+        root_a, root_b = self._find(a), self._find(b)
+        if root_a != root_b:
+            self._parent[root_b] = root_a
+            self._members[root_a].extend(self._members.pop(root_b))
+
+    def add_tile(self, tile, buildings):
+        """
+        Record a processed tile.
+        Returns:
+            List of finished buildings that can be written out now
+        """
+        self._done.add(tile)
+        finished = []
+        for building in buildings:
+            if not building["seams"]:
+                finished.append(finalize_building([building], self.weather, self.parameters))
+                continue
+            fragment_id = self._next_id
+            self._next_id += 1
+            building["_open"] = set(building["seams"])
+            self._fragments[fragment_id] = building
+            self._parent[fragment_id] = fragment_id
+            self._members[fragment_id] = [fragment_id]
+            for seam in building["seams"]:
+                self._seam_fragments.setdefault(seam, []).append((fragment_id, tile))
+        for seam in _tile_seams(*tile):
+            if self._seam_complete(seam):
+                finished.extend(self._close_seam(seam))
+        return finished
+
+    def _close_seam(self, seam):
+        entries = self._seam_fragments.pop(seam, [])
+        # Fragments on opposite sides whose extents along the seam overlap are one building
+        lo, hi = (1, 3) if seam[0] == "v" else (0, 2)
+        for i, (a, tile_a) in enumerate(entries):
+            for b, tile_b in entries[i + 1:]:
+                if tile_a == tile_b:
+                    continue
+                box_a, box_b = self._fragments[a]["bbox"], self._fragments[b]["bbox"]
+                if box_a[lo] < box_b[hi] and box_b[lo] < box_a[hi]:
+                    self._union(a, b)
+        finished = []
+        for fragment_id, _ in entries:
+            self._fragments[fragment_id]["_open"].discard(seam)
+        for fragment_id, _ in entries:
+            if fragment_id not in self._parent:
+                continue  # already emitted with its group
+            root = self._find(fragment_id)
+            members = self._members[root]
+            if all(not self._fragments[m]["_open"] for m in members):
+                finished.append(finalize_building([self._fragments[m] for m in members], self.weather, self.parameters))
+                for m in members:
+                    del self._fragments[m]
+                    del self._parent[m]
+                del self._members[root]
+        return finished
+
+    def pending(self):
+        """Number of fragments still waiting for a seam to close."""
+        return len(self._fragments)
+
+    def flush(self):
+        """Emit any held fragments as-is (e.g. when a run is interrupted)."""
+        finished = []
+        for root, members in list(self._members.items()):
+            finished.append(finalize_building([self._fragments[m] for m in members], self.weather, self.parameters))
+        self._fragments.clear()
+        self._parent.clear()
+        self._members.clear()
+        self._seam_fragments.clear()
+        return finished
+
+
+def finalize_building(fragments, weather, parameters):
+    """
+    Combine one or more fragments into an output record. Merged buildings take the
+    union bounding box as geometry, the summed usable area and the lowest confidence,
+    and have their per-building stages recomputed.
+    """
+    if len(fragments) == 1:
+        building = {k: v for k, v in fragments[0].items() if k not in ("seams", "_open")}
+        building["merged_fragments"] = 1
+    else:
+        bbox = [
+            min(f["bbox"][0] for f in fragments), min(f["bbox"][1] for f in fragments),
+            max(f["bbox"][2] for f in fragments), max(f["bbox"][3] for f in fragments),
+        ]
+        area = round(sum(f["usable_area_m2"] for f in fragments), 1)
+        confidence = min(f["confidence"] for f in fragments)
+        rooftop = {"usable_area_m2": area, "confidence": confidence}
+        building = {
+            "tile": fragments[0]["tile"],
+            "polygon": [[bbox[0], bbox[1]], [bbox[2], bbox[1]], [bbox[2], bbox[3]], [bbox[0], bbox[3]]],
+            "bbox": bbox,
+            "usable_area_m2": area,
+            "confidence": confidence,
+            "shading": fragments[0]["shading"],
+            "merged_fragments": len(fragments),
+        }
+        building.update(evaluate_building(rooftop, building["shading"], weather, parameters))
+    bbox = building["bbox"]
+    building["centroid"] = [(bbox[0] + bbox[2]) / 2.0, (bbox[1] + bbox[3]) / 2.0]
+    key = f"{building['centroid'][0]:.7f},{building['centroid'][1]:.7f}"
+    building["building_id"] = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return building
+
+
+# --- Streaming writers ---
+
+def building_properties(building):
+    """Flat properties shared by the GeoJSON and Parquet outputs."""
+    recommendation = building.get("recommendation", {})
+    roi = building.get("roi", {})
+    return {
+        "building_id": building.get("building_id"),
+        "address": building.get("address"),
+        "lon": building["centroid"][0] if building.get("centroid") else None,
+        "lat": building["centroid"][1] if building.get("centroid") else None,
+        "usable_area_m2": building.get("usable_area_m2"),
+        "confidence": building.get("confidence"),
+        "merged_fragments": building.get("merged_fragments"),
+        "panel_type": recommendation.get("panel_type"),
+        "num_panels": recommendation.get("num_panels"),
+        "system_size_kw": recommendation.get("system_size_kw"),
+        "cost_usd": roi.get("cost_usd"),
+        "estimated_annual_savings_usd": roi.get("estimated_annual_savings_usd"),
+        "payback_period_years": roi.get("payback_period_years"),
+        "error": building.get("error"),
+    }
+
+
+class GeoJSONWriter:
+    """Streams a GeoJSON FeatureCollection one feature at a time."""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = open(path, "w", encoding="utf-8")
+        self._file.write('{"type": "FeatureCollection", "features": [\n')
+
+    def write(self, building):
+        polygon = building.get("polygon")
+        geometry = {"type": "Polygon", "coordinates": [polygon + polygon[:1]]} if polygon else None
+        feature = {"type": "Feature", "geometry": geometry, "properties": building_properties(building)}
+        if self.count:
+            self._file.write(",\n")
+        self._file.write(json.dumps(feature))
+        self.count += 1
+
+    def close(self):
+        self._file.write("\n]}\n")
+        self._file.close()
+
+
+class ParquetWriter:
+    """Streams rows to Parquet in row groups of `batch_size` (requires pyarrow)."""
+
+    def __init__(self, path, batch_size=1000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow (pip install pyarrow); use a .geojson path instead.")
+        self._pa = pa
+        self.path = path
+        self.batch_size = batch_size
+        self.count = 0
+        self._rows = []
+        self._schema = pa.schema([
+            ("building_id", pa.string()), ("address", pa.string()),
+            ("lon", pa.float64()), ("lat", pa.float64()),
+            ("usable_area_m2", pa.float64()), ("confidence", pa.float64()),
+            ("merged_fragments", pa.int32()), ("panel_type", pa.string()),
+            ("num_panels", pa.int32()), ("system_size_kw", pa.float64()),
+            ("cost_usd", pa.float64()), ("estimated_annual_savings_usd", pa.float64()),
+            ("payback_period_years", pa.float64()), ("error", pa.string()),
+            ("geometry_wkt", pa.string()),
+        ])
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def write(self, building):
+        row = building_properties(building)
+        polygon = building.get("polygon")
+        row["geometry_wkt"] = (
+            "POLYGON((" + ", ".join(f"{lon} {lat}" for lon, lat in polygon + polygon[:1]) + "))" if polygon else None
+        )
+        self._rows.append(row)
+        self.count += 1
+        if len(self._rows) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            self._writer.write_table(self._pa.Table.from_pylist(self._rows, schema=self._schema))
+            self._rows = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+def open_writer(path):
+    """Pick a streaming writer from the output file extension (.geojson/.json or .parquet)."""
+    if path.endswith(".parquet"):
+        return ParquetWriter(path)
+    if path.endswith((".geojson", ".json")):
+        return GeoJSONWriter(path)
+    raise ValueError(f"Unsupported output format: {path} (use .geojson or .parquet)")
+
+
+# --- Execution ---
+
+def bounded_map(func, arg_tuples, workers, max_in_flight=None):
+    """
+    Apply func(*args) for each tuple, yielding results as they complete.
+    With workers > 0 tasks run in a process pool, and at most `max_in_flight`
+    are submitted at once so the input can be an arbitrarily long generator.
+    """
+    if workers <= 0:
+        for args in arg_tuples:
+            yield func(*args)
+        return
+    import multiprocessing
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    max_in_flight = max_in_flight or workers * 4
+    arg_iter = iter(arg_tuples)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        in_flight = set()
+        exhausted = False
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < max_in_flight:
+                try:
+                    args = next(arg_iter)
+                except StopIteration:
+                    exhausted = True
+                    break
+                in_flight.add(pool.submit(func, *args))
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def run_portfolio(bbox, output_path, zoom=DEFAULT_ZOOM, workers=None, max_in_flight=None,
+                  fetch_tile=fetch_satellite_tile, parameters=None):
+    """
+    Assess every rooftop inside bbox = (min_lon, min_lat, max_lon, max_lat).
+    Returns:
+        Summary dict with tiles, failed_tiles, buildings and elapsed_sec
+    """
+    start_time = time.time()
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    x_min, x_max, y_min, y_max = tile_range(bbox, zoom)
+    dedup = SeamDeduplicator((x_min, x_max), (y_min, y_max), parameters=parameters)
+    writer = open_writer(output_path)
+    tiles = failed = 0
+    try:
+        tasks = ((zoom, x, y, fetch_tile, parameters) for x, y in iter_tiles(bbox, zoom))
+        for result in bounded_map(analyze_tile, tasks, workers, max_in_flight):
+            tiles += 1
+            if result["error"]:
+                failed += 1
+                print(f"Tile {zoom}/{result['tile'][0]}/{result['tile'][1]}: {result['error']}")
+            for building in dedup.add_tile(result["tile"], result["buildings"]):
+                writer.write(building)
+        for building in dedup.flush():
+            writer.write(building)
+    finally:
+        writer.close()
+    return {"tiles": tiles, "failed_tiles": failed, "buildings": writer.count, "elapsed_sec": time.time() - start_time}
+
+
+def analyze_address(address, parameters=None):
+    """Fetch, detect and evaluate the single rooftop at an address (worker function)."""
+    image = fetch_and_preprocess_image({"address": address})
+    building = {"address": address, "polygon": None, "centroid": None}
+    if image is None:
+        building["error"] = "Image acquisition failed."
+        return building
+    rooftop = detect_and_segment_rooftop(image)
+    if not rooftop:
+        building["error"] = "Rooftop detection failed."
+        return building
+    shading = analyze_shading_and_obstacles(image, rooftop)
+    building.update({
+        "building_id": hashlib.sha1(address.encode()).hexdigest()[:16],
+        "usable_area_m2": rooftop.get("usable_area_m2"),
+        "confidence": rooftop.get("confidence"),
+        "merged_fragments": 1,
+    })
+    building.update(evaluate_building(rooftop, shading, fetch_mock_weather(), parameters))
+    return building
+
+
+def run_addresses(addresses, output_path, workers=None, max_in_flight=None, parameters=None):
+    """Assess one rooftop per address from an iterable (e.g. a file object), streaming results."""
+    start_time = time.time()
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    writer = open_writer(output_path)
+    failed = 0
+    try:
+        tasks = ((a.strip(), parameters) for a in addresses if a.strip())
+        for building in bounded_map(analyze_address, tasks, workers, max_in_flight):
+            if building.get("error"):
+                failed += 1
+            writer.write(building)
+    finally:
+        writer.close()
+    return {"addresses": writer.count, "failed": failed, "elapsed_sec": time.time() - start_time}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Portfolio-scale rooftop solar analysis")
+    parser.add_argument('--bbox', type=str, help='min_lon,min_lat,max_lon,max_lat to tile and assess')
+    parser.add_argument('--addresses', type=str, help='Text file with one address per line')
+    parser.add_argument('--zoom', type=int, default=DEFAULT_ZOOM, help='Tile zoom level for --bbox')
+    parser.add_argument('--out', type=str, required=True, help='Output path (.geojson or .parquet)')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count, 0 = inline)')
+    parser.add_argument('--max_in_flight', type=int, default=None, help='Max queued tasks (default: 4 x workers)')
+    args = parser.parse_args()
+
+    if args.bbox:
+        bbox = tuple(float(v) for v in args.bbox.split(","))
+        summary = run_portfolio(bbox, args.out, zoom=args.zoom, workers=args.workers, max_in_flight=args.max_in_flight)
+    elif args.addresses:
+        with open(args.addresses, encoding="utf-8") as f:
+            summary = run_addresses(f, args.out, workers=args.workers, max_in_flight=args.max_in_flight)
+    else:
+        parser.error("one of --bbox or --addresses is required")
+    print(f"[PERF] Portfolio run: {summary}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,401 @@
 # Handles report generation
+import base64
+import hashlib
+import html
+import io
+import json
+import os
+import re
+import threading
+import time
+from string import Template
+
+from PIL import Image, ImageDraw, ImageFont
+
+REPORT_DIR = os.environ.get("REPORT_DIR", "reports")
+
+# Context keys that do not affect the rendered report (excluded from the cache key)
+_VOLATILE_KEYS = (
+    "image", "performance", "report_path", "report_url",
+    # Re-quote lineage: the same figures reached via different re-quotes share one report
+    "analysis_id", "parent_analysis_id", "recomputed_stages"
+)
+
+# Ground resolution assumed when drawing panel layouts given in metres
+PIXELS_PER_METER = 10
+
+# Templates are compiled once at import time and reused for every report
+HTML_TEMPLATE = Template("""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Solar Rooftop Report</title>
+<style>
+body { font-family: sans-serif; margin: 2em; color: #222; }
+table { border-collapse: collapse; margin-bottom: 1.5em; }
+td, th { border: 1px solid #ccc; padding: 4px 8px; text-align: left; }
+img { max-width: 512px; border: 1px solid #ccc; }
+</style>
+</head>
+<body>
+<h1>Solar Rooftop Report</h1>
+<p>$summary</p>
+<img src="$overlay_src" alt="Rooftop overlay with panel layout and shading">
+$sections
+</body>
+</html>
+""")
+SECTION_TEMPLATE = Template("<h2>$title</h2>\n<table>\n$rows</table>\n")
+ROW_TEMPLATE = Template("<tr><th>$key</th><td>$value</td></tr>\n")
+
+REPORT_SECTIONS = [
+    ("Rooftop Validation", "rooftop_validation"),
+    ("Solar Assessment", "assessment"),
+    ("System Recommendation", "recommendation"),
+    ("Cost & ROI", "roi"),
+]
+
+# A4 page at 100 dpi
+PAGE_SIZE = (827, 1169)
+
+
+def report_cache_key(context):
+    """
+    Content hash of everything that influences the rendered report.
+    Identical analyses map to the same key, so re-rendering them is free.
+    """
+    digest = hashlib.sha256()
+    stable = {k: v for k, v in context.items() if k not in _VOLATILE_KEYS}
+    digest.update(json.dumps(stable, sort_keys=True, default=str).encode())
+    image = context.get("image")
+    if image is not None:
+        digest.update(image.tobytes())
+    return digest.hexdigest()[:32]
+
+
+def report_paths(key, report_dir=None):
+    """Paths of the PDF, HTML and overlay files for a cache key."""
+    report_dir = report_dir or REPORT_DIR
+    return {
+        "pdf": os.path.join(report_dir, f"{key}.pdf"),
+        "html": os.path.join(report_dir, f"{key}.html"),
+        "overlay": os.path.join(report_dir, f"{key}_overlay.png"),
+    }
+
+
+def parse_polygon(mask):
+    """Extract (x, y) vertices from a mask like 'POLYGON((100,100),(400,100),...)'."""
+    if not isinstance(mask, str):
+        return []
+    return [(float(x), float(y)) for x, y in re.findall(r"\(?\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*\)?", mask)]
+
+
+def render_overlay(context):
+    """
+    Draw the rooftop outline, shaded regions and panel layout on top of the image.
+    Returns:
+        PIL.Image (RGB)
+    """
+    image = context.get("image")
+    base = image.convert("RGB") if image is not None else Image.new("RGB", (512, 512), "white")
+    overlay = Image.new("RGBA", base.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+
+    polygon = parse_polygon((context.get("rooftop") or {}).get("mask"))
+    if len(polygon) >= 3:
+        draw.polygon(polygon, fill=(255, 200, 0, 60), outline=(255, 160, 0, 255))
+
+    shading = context.get("shading")
+    regions = shading.get("regions", []) if isinstance(shading, dict) else []
+    for region in regions:
+        points = parse_polygon(region) if isinstance(region, str) else [tuple(p) for p in region]
+        if len(points) >= 3:
+            draw.polygon(points, fill=(40, 40, 120, 110))
+
+    for panel in (context.get("recommendation") or {}).get("layout", []):
+        x, y = panel.get("x", 0), panel.get("y", 0)
+        w = panel.get("width", 1) * PIXELS_PER_METER
+        h = panel.get("height", 2) * PIXELS_PER_METER
+        draw.rectangle([x, y, x + w, y + h], fill=(0, 90, 200, 150), outline=(0, 40, 120, 255))
+
+    return Image.alpha_composite(base.convert("RGBA"), overlay).convert("RGB")
+
+
+def _section_rows(data):
+    if not isinstance(data, dict):
+        return [("value", data)]
+    return [(k, json.dumps(v) if isinstance(v, (dict, list)) else v) for k, v in data.items()]
+
+
+def render_html(context, overlay_png):
+    # The overlay is embedded as a data URI so the page renders the same from disk or from /reports
+    sections = []
+    for title, key in REPORT_SECTIONS:
+        rows = "".join(
+            ROW_TEMPLATE.substitute(key=html.escape(str(k)), value=html.escape(str(v)))
+            for k, v in _section_rows(context.get(key, {}))
+        )
+        sections.append(SECTION_TEMPLATE.substitute(title=html.escape(title), rows=rows))
+    summary = (context.get("rooftop") or {}).get("summary", "")
+    return HTML_TEMPLATE.substitute(
+        summary=html.escape(str(summary)),
+        overlay_src="data:image/png;base64," + base64.b64encode(overlay_png).decode("ascii"),
+        sections="".join(sections)
+    )
+
+
+def render_pdf_page(context, overlay):
+    """
+    Lay out the overlay and report tables on a single A4 page image. The PDF is a
+    100 dpi raster (Pillow's bitmap font, rows truncated to fit), so its text is
+    not selectable; the HTML report carries the full, selectable content.
+    """
+    page = Image.new("RGB", PAGE_SIZE, "white")
+    draw = ImageDraw.Draw(page)
+    font = ImageFont.load_default()
+    margin = 40
+    y = margin
+    draw.text((margin, y), "Solar Rooftop Report", fill="black", font=font)
+    y += 20
+    summary = str((context.get("rooftop") or {}).get("summary", ""))
+    draw.text((margin, y), summary[:120], fill="black", font=font)
+    y += 25
+    thumb = overlay.copy()
+    thumb.thumbnail((400, 400))
+    page.paste(thumb, (margin, y))
+    y += thumb.size[1] + 20
+    for title, key in REPORT_SECTIONS:
+        draw.text((margin, y), title, fill="black", font=font)
+        y += 16
+        for k, v in _section_rows(context.get(key, {})):
+            draw.text((margin + 15, y), f"{k}: {v}"[:110], fill="black", font=font)
+            y += 14
+        y += 10
+    return page
+
+
+def _atomic_write(path, write):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def render_report(context, key=None, report_dir=None):
+    """
+    Render the overlay image, HTML and PDF reports for `context`.
+    Files are written atomically, so a present PDF is always complete.
+    Returns:
+        report_path: Path to the PDF report
+    """
+    key = key or report_cache_key(context)
+    paths = report_paths(key, report_dir)
+    os.makedirs(os.path.dirname(paths["pdf"]) or ".", exist_ok=True)
+
+    overlay = render_overlay(context)
+    buf = io.BytesIO()
+    overlay.save(buf, format="PNG")
+    overlay_png = buf.getvalue()
+
+    def write_overlay(p):
+        with open(p, "wb") as f:
+            f.write(overlay_png)
+    _atomic_write(paths["overlay"], write_overlay)
+
+    html_doc = render_html(context, overlay_png)
+
+    def write_html(p):
+        with open(p, "w", encoding="utf-8") as f:
+            f.write(html_doc)
+    _atomic_write(paths["html"], write_html)
+
+    page = render_pdf_page(context, overlay)
+    # The PDF is written last: its presence marks the report as complete
+    _atomic_write(paths["pdf"], lambda p: page.save(p, format="PDF", resolution=100.0))
+    return paths["pdf"]
+
 
 def generate_report(context):
     """
     Generate visual summary and detailed report (PDF/HTML) using context.
+    Reports are cached by content hash; an unchanged report is not re-rendered.
     Args:
         context: Dict with all workflow data
     Returns:
-        report_path: Path to generated report (placeholder)
+        report_path: Path to generated PDF report
+    """
+    key = report_cache_key(context)
+    report_path = report_paths(key)["pdf"]
+    if os.path.exists(report_path):
+        return report_path
+    return render_report(context, key)
+
+
+# --- Cache eviction ---
+# Every distinct analysis and re-quote adds ~50 KB of report files, so REPORT_DIR is
+# pruned by age and total size. Evicted reports return 404 from GET /reports/<key>.
+REPORT_MAX_AGE_SEC = float(os.environ.get("REPORT_MAX_AGE_SEC", str(7 * 24 * 3600)))
+REPORT_MAX_BYTES = int(os.environ.get("REPORT_MAX_BYTES", str(1024 ** 3)))
+REPORT_EVICT_INTERVAL_SEC = float(os.environ.get("REPORT_EVICT_INTERVAL_SEC", "60"))
+_REPORT_FILE_PATTERN = re.compile(r"^([0-9a-f]{32})(?:\.pdf|\.html|_overlay\.png)$")
+_evict_lock = threading.Lock()
+_last_eviction = 0.0
+
+
+def evict_reports(report_dir=None, max_age_sec=None, max_bytes=None, now=None):
+    """
+    Delete cached reports older than `max_age_sec`, then the least recently
+    written ones until the directory holds at most `max_bytes`. Reports still
+    rendering are kept.
+    Returns:
+        Number of reports (cache keys) removed
+    """
+    report_dir = report_dir or REPORT_DIR
+    max_age_sec = REPORT_MAX_AGE_SEC if max_age_sec is None else max_age_sec
+    max_bytes = REPORT_MAX_BYTES if max_bytes is None else max_bytes
+    now = time.time() if now is None else now
+    reports = {}  # key -> [newest mtime, total bytes, paths]
+    try:
+        entries = list(os.scandir(report_dir))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        match = _REPORT_FILE_PATTERN.match(entry.name)
+        if match is None:
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        report = reports.setdefault(match.group(1), [0.0, 0, []])
+        report[0] = max(report[0], stat.st_mtime)
+        report[1] += stat.st_size
+        report[2].append(entry.path)
+    total = sum(size for _, size, _ in reports.values())
+    removed = 0
+    for key, (mtime, size, paths) in sorted(reports.items(), key=lambda item: item[1][0]):
+        if now - mtime <= max_age_sec and total <= max_bytes:
+            break
+        if key in _pending:
+            continue
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total -= size
+        removed += 1
+    return removed
+
+
+def _maybe_evict_reports():
+    # At most one scan per interval, and never more than one thread scanning at once
+    global _last_eviction
+    if time.time() - _last_eviction < REPORT_EVICT_INTERVAL_SEC or not _evict_lock.acquire(blocking=False):
+        return
+    try:
+        _last_eviction = time.time()
+        evict_reports()
+    except OSError as e:
+        print(f"Report eviction failed: {e}")
+    finally:
+        _evict_lock.release()
+
+
+# --- Off-request-path rendering ---
+# Rendering is CPU-bound, so it runs in a process pool created on first use.
+# REPORT_WORKERS=0 renders inline (useful for tests and single-shot CLI runs).
+_pool = None
+_pool_lock = threading.Lock()
+_pending = {}
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            workers = int(os.environ.get("REPORT_WORKERS", str(os.cpu_count() or 1)))
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def warm_up():
+    """Start the render pool and its worker processes ahead of the first report."""
+    if os.environ.get("REPORT_WORKERS") == "0":
+        return
+    pool = _get_pool()
+    # Spawned workers start (and import this module) on demand; force them up now
+    workers = int(os.environ.get("REPORT_WORKERS", str(os.cpu_count() or 1)))
+    for future in [pool.submit(os.getpid) for _ in range(workers)]:
+        future.result()
+
+
+def _report_context(context):
+    # Snapshot the fields the renderer needs; the caller keeps mutating its context
+    snapshot = json.loads(json.dumps({k: v for k, v in context.items() if k not in _VOLATILE_KEYS}, default=str))
+    snapshot["image"] = context.get("image")
+    return snapshot
+
+
+def _forget_if_done(key, future):
+    # Keep failed renders around so report_status() can report them (a resubmit replaces them)
+    if future.exception() is None:
+        with _pool_lock:
+            if _pending.get(key) is future:
+                del _pending[key]
+
+
+def submit_report(context):
+    """
+    Schedule rendering of `context` without waiting for it. Safe to call from
+    several threads: concurrent identical analyses share one render.
+    Returns:
+        (report_path, key): Where the PDF will appear, and its cache key
+    """
+    _maybe_evict_reports()
+    key = report_cache_key(context)
+    report_path = report_paths(key)["pdf"]
+    if report_status(key) in ("ready", "rendering"):
+        return report_path, key
+    if os.environ.get("REPORT_WORKERS") == "0":
+        render_report(context, key)
+        return report_path, key
+    pool = _get_pool()
+    snapshot = _report_context(context)
+    with _pool_lock:
+        # Re-check under the lock; only a missing or failed render is (re)submitted
+        if report_status(key) in ("ready", "rendering"):
+            return report_path, key
+        future = pool.submit(render_report, snapshot, key, REPORT_DIR)
+        _pending[key] = future
+    # Outside the lock: the callback runs immediately if the render already finished
+    future.add_done_callback(lambda f: _forget_if_done(key, f))
+    return report_path, key
+
+
+def report_status(key):
+    """Return 'ready', 'rendering', 'failed' or 'unknown' for a report cache key."""
+    if os.path.exists(report_paths(key)["pdf"]):
+        return "ready"
+    future = _pending.get(key)
+    if future is None:
+        return "unknown"
+    if future.done() and future.exception() is not None:
+        return "failed"
+    return "rendering"
+
+
+def generate_reports(contexts, chunksize=8):
+    """
+    Render many reports in bulk across the process pool, skipping cached ones.
+    Returns:
+        List of PDF paths, in input order
     """
-    # TODO: Implement report generation
-    return "report.pdf"
+    _maybe_evict_reports()
+    keys = [report_cache_key(c) for c in contexts]
+    todo = [(c, k) for c, k in zip(contexts, keys) if not os.path.exists(report_paths(k)["pdf"])]
+    if todo:
+        snapshots = [_report_context(c) for c, _ in todo]
+        list(_get_pool().map(render_report, snapshots, [k for _, k in todo], [REPORT_DIR] * len(todo), chunksize=chunksize))
+    return [report_paths(k)["pdf"] for k in keys]
@@ -1,5 +1,4 @@
 # Handles rooftop detection and segmentation using Vision AI (e.g., OpenAI GPT-4 Vision)
-import openai
 import io
 import os
 from dotenv import load_dotenv
@@ -8,33 +7,55 @@ import json
 import re
 import base64
 
-def detect_and_segment_rooftop(image):
-    """
-    Use Vision AI model to detect rooftop boundaries and segment usable area.
-    Args:
-        image: Preprocessed PIL.Image object
-    Returns:
-        rooftop_mask: Dict with fields mask, usable_area_m2, summary
-    """
+# The openai package is slow to import, so it is loaded on first real (non-mock) call
+_openai = None
+
+def get_openai():
+    """Import and cache the openai module, configuring the API key from the environment."""
+    global _openai
+    if _openai is None:
+        import openai
+        _openai = openai
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if api_key:
+        _openai.api_key = api_key
+    return _openai
+
+def warm_up():
+    """Preload the OpenAI client so the first request does not pay for the import."""
     load_dotenv()
-    # Mock mode for simulation
     if os.environ.get("MOCK_VISION_AI") == "1":
-        import random
-        print("[MOCK] Returning simulated Vision AI output.")
-        mock_result = {
-            "mask": "POLYGON((100,100),(400,100),(400,400),(100,400))",
-            "usable_area_m2": 42.3,
-            "summary": "Rooftop area detected and segmented. Usable area is approximately 42.3 m^2.",
-            "confidence": round(random.uniform(0.7, 0.99), 2)
-        }
-        print(f"Parsed Vision AI JSON: {mock_result}")
-        return mock_result
+        return
+    openai = get_openai()
+    if openai.api_key:
+        # Touching the resource builds the module-level client (HTTP pool, config)
+        openai.chat.completions
+
+def extract_json_str(ai_content):
+    """Extract the JSON object from a Vision AI reply (handles code blocks or extra text)."""
+    json_str = ai_content
+    # Remove markdown code block if present
+    if json_str.startswith('```json'):
+        json_str = re.sub(r'^```json|```$', '', json_str).strip()
+    elif json_str.startswith('```'):
+        json_str = re.sub(r'^```|```$', '', json_str).strip()
+    # Find the first JSON object in the string
+    match = re.search(r'\{.*\}', json_str, re.DOTALL)
+    if match:
+        json_str = match.group(0)
+    return json_str
 
+def ask_vision_ai(image, system_prompt, user_prompt):
+    """
+    Send an image and prompts to the Vision AI model.
+    Returns:
+        The stripped text reply, or None if the API key is missing or the call failed
+    """
     api_key = os.environ.get("OPENAI_API_KEY")  # Loaded from .env
     if not api_key:
         print("OPENAI_API_KEY not set in environment or .env file.")
         return None
-    openai.api_key = api_key
+    openai = get_openai()
 
     # Convert image to bytes
     img_bytes = io.BytesIO()
@@ -47,54 +68,132 @@ def detect_and_segment_rooftop(image):
             model="gpt-4o",  # Updated to gpt-4o, OpenAI's latest multimodal model (May 2025)
 
             messages=[
-                {"role": "system", "content": (
-                    "You are a solar analysis assistant. "
-                    "Given a rooftop image, always return ONLY a strict JSON object (no explanation, no markdown, no extra text) with these fields: "
-                    "mask (as a description or coordinates), usable_area_m2 (float), summary (string), confidence (float between 0 and 1). "
-                    "Example: {\"mask\": \"polygon coordinates...\", \"usable_area_m2\": 40.5, \"summary\": \"Rooftop area detected...\", \"confidence\": 0.92}"
-                )},
+                {"role": "system", "content": system_prompt},
                 {"role": "user", "content": [
-                    {"type": "text", "text": (
-                        "Identify the rooftop boundaries and usable area in this image. "
-                        "Return ONLY a strict JSON object with: mask (as a description or coordinates), usable_area_m2 (float), summary (string), and confidence (float between 0 and 1)."
-                    )},
+                    {"type": "text", "text": user_prompt},
                     {"type": "image_url", "image_url": {"url": "data:image/png;base64," + base64.b64encode(img_bytes.getvalue()).decode()}}
                 ]}
             ],
             max_tokens=1024
         )
-        content = response.choices[0].message.content
-        if content is None:
-            print("[ERROR] Vision AI API did not return any content. Raw response:")
-            print(response)
-            return None
-        ai_content = content.strip()
-        print(f"Vision AI raw response: {ai_content}")
-
-        # Extract JSON from response (handle code blocks or extra text)
-        json_str = ai_content
-        # Remove markdown code block if present
-        if json_str.startswith('```json'):
-            json_str = re.sub(r'^```json|```$', '', json_str).strip()
-        elif json_str.startswith('```'):
-            json_str = re.sub(r'^```|```$', '', json_str).strip()
-        # Find the first JSON object in the string
-        match = re.search(r'\{.*\}', json_str, re.DOTALL)
-        if match:
-            json_str = match.group(0)
-        try:
-            result = json.loads(json_str)
-            # Validate required fields
-            for field in ["mask", "usable_area_m2", "summary", "confidence"]:
-                if field not in result:
-                    raise ValueError(f"Missing field: {field}")
-            # Ensure confidence is a float
-            result["confidence"] = float(result["confidence"])
-            print(f"Parsed Vision AI JSON: {result}")
-            return result
-        except Exception as e:
-            print(f"Error parsing Vision AI JSON: {e}\nRaw response: {ai_content}")
-            return None
     except Exception as e:
         print(f"Vision AI API error: {e}")
         return None
+    content = response.choices[0].message.content
+    if content is None:
+        print("[ERROR] Vision AI API did not return any content. Raw response:")
+        print(response)
+        return None
+    ai_content = content.strip()
+    print(f"Vision AI raw response: {ai_content}")
+    return ai_content
+
+def detect_and_segment_rooftop(image):
+    """
+    Use Vision AI model to detect rooftop boundaries and segment usable area.
+    Args:
+        image: Preprocessed PIL.Image object
+    Returns:
+        rooftop_mask: Dict with fields mask, usable_area_m2, summary
+    """
+    load_dotenv()
+    # Mock mode for simulation
+    if os.environ.get("MOCK_VISION_AI") == "1":
+        import random
+        print("[MOCK] Returning simulated Vision AI output.")
+        mock_result = {
+            "mask": "POLYGON((100,100),(400,100),(400,400),(100,400))",
+            "usable_area_m2": 42.3,
+            "summary": "Rooftop area detected and segmented. Usable area is approximately 42.3 m^2.",
+            "confidence": round(random.uniform(0.7, 0.99), 2)
+        }
+        print(f"Parsed Vision AI JSON: {mock_result}")
+        return mock_result
+
+    ai_content = ask_vision_ai(
+        image,
+        (
+            "You are a solar analysis assistant. "
+            "Given a rooftop image, always return ONLY a strict JSON object (no explanation, no markdown, no extra text) with these fields: "
+            "mask (as a description or coordinates), usable_area_m2 (float), summary (string), confidence (float between 0 and 1). "
+            "Example: {\"mask\": \"polygon coordinates...\", \"usable_area_m2\": 40.5, \"summary\": \"Rooftop area detected...\", \"confidence\": 0.92}"
+        ),
+        (
+            "Identify the rooftop boundaries and usable area in this image. "
+            "Return ONLY a strict JSON object with: mask (as a description or coordinates), usable_area_m2 (float), summary (string), and confidence (float between 0 and 1)."
+        )
+    )
+    if ai_content is None:
+        return None
+    try:
+        result = json.loads(extract_json_str(ai_content))
+        # Validate required fields
+        for field in ["mask", "usable_area_m2", "summary", "confidence"]:
+            if field not in result:
+                raise ValueError(f"Missing field: {field}")
+        # Ensure confidence is a float
+        result["confidence"] = float(result["confidence"])
+        print(f"Parsed Vision AI JSON: {result}")
+        return result
+    except Exception as e:
+        print(f"Error parsing Vision AI JSON: {e}\nRaw response: {ai_content}")
+        return None
+
+def format_polygon_mask(points):
+    """Format pixel vertices as the 'POLYGON((x,y),...)' mask string used across the project."""
+    return "POLYGON(" + ",".join(f"({round(x)},{round(y)})" for x, y in points) + ")"
+
+# Simulated buildings for mock mode: one interior roof and one straddling the
+# left/right tile seams, so adjacent mock tiles exercise seam deduplication.
+_MOCK_TILE_ROOFTOPS = [
+    {"polygon": [[100, 100], [200, 100], [200, 180], [100, 180]], "confidence": 0.9},
+    {"polygon": [[440, 300], [512, 300], [512, 380], [440, 380]], "confidence": 0.85},
+    {"polygon": [[0, 300], [60, 300], [60, 380], [0, 380]], "confidence": 0.8},
+]
+
+def detect_rooftops_in_tile(image):
+    """
+    Use Vision AI to detect every rooftop in a satellite tile.
+    Args:
+        image: PIL.Image tile (typically 512x512)
+    Returns:
+        List of dicts with polygon (pixel [x, y] vertices), mask, confidence and,
+        when the model provides it, usable_area_m2. Empty list on failure.
+    """
+    load_dotenv()
+    if os.environ.get("MOCK_VISION_AI") == "1":
+        rooftops = []
+        for mock in _MOCK_TILE_ROOFTOPS:
+            rooftop = {"polygon": [list(p) for p in mock["polygon"]], "confidence": mock["confidence"]}
+            rooftop["mask"] = format_polygon_mask(rooftop["polygon"])
+            rooftops.append(rooftop)
+        return rooftops
+
+    width, height = image.size
+    ai_content = ask_vision_ai(
+        image,
+        (
+            "You are a solar analysis assistant. "
+            "Given a top-down satellite tile, always return ONLY a strict JSON object (no explanation, no markdown, no extra text) "
+            "of the form {\"rooftops\": [{\"polygon\": [[x, y], ...], \"usable_area_m2\": float, \"confidence\": float}]}. "
+            f"Polygon vertices are pixel coordinates in a {width}x{height} image with the origin at the top-left. "
+            "Include roofs cut off by the image border, with vertices on the border."
+        ),
+        "Outline every building rooftop in this tile and estimate the usable area for solar panels of each."
+    )
+    if ai_content is None:
+        return []
+    try:
+        rooftops = []
+        for item in json.loads(extract_json_str(ai_content)).get("rooftops", []):
+            polygon = [[float(x), float(y)] for x, y in item["polygon"]]
+            if len(polygon) < 3:
+                continue
+            rooftop = {"polygon": polygon, "mask": format_polygon_mask(polygon), "confidence": float(item.get("confidence", 0.0))}
+            if "usable_area_m2" in item:
+                rooftop["usable_area_m2"] = float(item["usable_area_m2"])
+            rooftops.append(rooftop)
+        return rooftops
+    except Exception as e:
+        print(f"Error parsing Vision AI JSON: {e}\nRaw response: {ai_content}")
+        return []
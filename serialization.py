@@ -0,0 +1,194 @@
+# Response encoding for analysis contexts: JSON (orjson when available) or compact msgpack
+import itertools
+import json
+import re
+import sys
+from array import array
+
+from fastapi.responses import Response
+
+# Optional dependencies: fall back to the stdlib JSON encoder when missing
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+# Numeric lists at least this long are packed as raw little-endian buffers
+ARRAY_MIN_LENGTH = 64
+
+# Little-endian dtype -> array typecode, smallest integer width first
+_INT_DTYPES = [
+    ("<i1", "b", -2 ** 7, 2 ** 7 - 1),
+    ("<i2", "h", -2 ** 15, 2 ** 15 - 1),
+    ("<i4", "i" if array("i").itemsize == 4 else "l", -2 ** 31, 2 ** 31 - 1),
+    ("<i8", "q", -2 ** 63, 2 ** 63 - 1),
+]
+_TYPECODES = {dtype: code for dtype, code, _, _ in _INT_DTYPES}
+_TYPECODES["<f8"] = "d"
+
+_RUN_PATTERN = re.compile(rb"\x00+|\x01+")
+
+_ARRAY_TAG = "__array__"
+_MASK_TAG = "__rle_mask__"
+
+
+def _to_little_endian(values):
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def encode_array(values):
+    """
+    Pack a flat list of numbers as a raw little-endian buffer.
+    Integers use the narrowest signed width that fits; anything else is float64 ('<f8').
+    """
+    if values and all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        low, high = min(values), max(values)
+        for dtype, code, min_value, max_value in _INT_DTYPES:
+            if min_value <= low and high <= max_value:
+                return {_ARRAY_TAG: dtype, "length": len(values), "data": _to_little_endian(array(code, values))}
+    return {_ARRAY_TAG: "<f8", "length": len(values), "data": _to_little_endian(array("d", values))}
+
+
+def decode_array(packed):
+    values = array(_TYPECODES[packed[_ARRAY_TAG]])
+    values.frombytes(packed["data"])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tolist()
+
+
+def _flatten_binary_mask(mask):
+    """Return the mask as one bytes object of 0/1 values, or None if it is not a binary mask."""
+    try:
+        flat = bytes(itertools.chain.from_iterable(mask))
+    except (TypeError, ValueError):
+        return None
+    if flat.translate(None, b"\x00\x01"):
+        return None
+    return flat
+
+
+def rle_encode_mask(mask, flat=None):
+    """
+    Run-length encode a rectangular 2D binary mask (list of equal-length rows of 0/1) in row-major order.
+    Counts alternate starting with a run of zeros (which may be empty).
+    """
+    height = len(mask)
+    width = len(mask[0]) if height else 0
+    if flat is None:
+        flat = _flatten_binary_mask(mask)
+    # Runs are found by the regex engine, so the Python loop is per run, not per pixel
+    counts = [len(run.group()) for run in _RUN_PATTERN.finditer(flat)]
+    if flat[:1] == b"\x01":
+        counts.insert(0, 0)
+    return {_MASK_TAG: [height, width], "counts": counts}
+
+
+def rle_decode_mask(encoded):
+    height, width = encoded[_MASK_TAG]
+    flat = b"".join((b"\x01" if i % 2 else b"\x00") * count for i, count in enumerate(encoded["counts"]))
+    return [list(flat[i * width:(i + 1) * width]) for i in range(height)]
+
+
+def _is_numeric_array(value):
+    return (
+        isinstance(value, list) and len(value) >= ARRAY_MIN_LENGTH
+        and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value)
+    )
+
+
+def compact(value, key=None):
+    """Recursively replace masks with RLE and long numeric lists with packed buffers."""
+    if isinstance(value, dict):
+        return {k: compact(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        if (
+            key is not None and str(key).endswith("mask") and value
+            and all(isinstance(row, list) for row in value)
+            and len({len(row) for row in value}) == 1
+        ):
+            # Only rectangular masks: the decoded width comes from a single row length
+            flat = _flatten_binary_mask(value)
+            if flat is not None:
+                return rle_encode_mask(value, flat)
+        if _is_numeric_array(value):
+            return encode_array(value)
+        return [compact(v) for v in value]
+    return value
+
+
+def expand(value):
+    """Inverse of compact(): restore masks and arrays to plain lists."""
+    if isinstance(value, dict):
+        if _ARRAY_TAG in value:
+            return decode_array(value)
+        if _MASK_TAG in value:
+            return rle_decode_mask(value)
+        return {k: expand(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [expand(v) for v in value]
+    return value
+
+
+def dumps_json(context):
+    if orjson is not None:
+        return orjson.dumps(context)
+    return json.dumps(context, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_msgpack(context):
+    return msgpack.packb(compact(context), use_bin_type=True)
+
+
+def loads_msgpack(data):
+    """Decode a compact msgpack response back into a plain context dict."""
+    return expand(msgpack.unpackb(data, raw=False))
+
+
+def negotiate(accept):
+    """
+    Pick the response media type from an Accept header (msgpack only if installed and asked for).
+    The highest q-value wins, ties go to the earlier entry, and q=0 entries are refused.
+    """
+    if msgpack is None or not accept:
+        return JSON_MEDIA_TYPE
+    best, best_q = None, 0.0
+    for part in accept.split(","):
+        fields = part.split(";")
+        media_type = fields[0].strip().lower()
+        if media_type in MSGPACK_MEDIA_TYPES:
+            candidate = MSGPACK_MEDIA_TYPES[0]
+        elif media_type in (JSON_MEDIA_TYPE, "*/*"):
+            candidate = JSON_MEDIA_TYPE
+        else:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > best_q:
+            best, best_q = candidate, q
+    return best or JSON_MEDIA_TYPE
+
+
+def render_context(context, accept=None, status_code=200, headers=None):
+    """Encode `context` in the format the client asked for and wrap it in a Response."""
+    media_type = negotiate(accept)
+    body = dumps_msgpack(context) if media_type != JSON_MEDIA_TYPE else dumps_json(context)
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept"
+    return Response(content=body, status_code=status_code, media_type=media_type, headers=headers)
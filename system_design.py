@@ -1,18 +1,33 @@
 # Handles system design and recommendations
 
+DEFAULT_PANEL_TYPE = "Monocrystalline 400W"
+
+# Rated output of each supported panel type (watts)
+PANEL_TYPES = {
+    "Monocrystalline 400W": 400,
+    "Polycrystalline 330W": 330,
+    "Thin-film 150W": 150
+}
+
 def recommend_system(context):
     """
     Suggest optimal panel type, number, and placement. Recommend inverter and mounting system.
     Args:
-        context: Dict with all workflow data
+        context: Dict with all workflow data (context['parameters']['panel_type'] overrides the panel)
     Returns:
         recommendation: Dict with system design
     """
     assessment = context.get('assessment', {})
+    parameters = context.get('parameters', {})
+    panel_type = parameters.get('panel_type', DEFAULT_PANEL_TYPE)
+    if panel_type not in PANEL_TYPES:
+        raise ValueError(f"Unknown panel type: {panel_type}")
     num_panels = assessment.get('layout_options', [{}])[0].get('panel_count', 0)
     recommendation = {
-        "panel_type": "Monocrystalline 400W",
+        "panel_type": panel_type,
+        "panel_watts": PANEL_TYPES[panel_type],
         "num_panels": num_panels,
+        "system_size_kw": round(num_panels * PANEL_TYPES[panel_type] / 1000.0, 2),
         "layout": [{"x": 10, "y": 20, "width": 1, "height": 2}],
         "inverter": "5kW string inverter",
         "mounting": "flush mount"
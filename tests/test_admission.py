@@ -0,0 +1,52 @@
+import asyncio
+import pytest
+from admission import AdmissionController, AdmissionRejected, TokenBucketLimiter
+
+def test_token_bucket_allows_burst_then_limits():
+    limiter = TokenBucketLimiter(rate_per_sec=1.0, burst=2)
+    assert limiter.try_acquire("a", now=0.0) == 0.0
+    assert limiter.try_acquire("a", now=0.0) == 0.0
+    wait = limiter.try_acquire("a", now=0.0)
+    assert wait == pytest.approx(1.0)
+    # Other clients have their own bucket
+    assert limiter.try_acquire("b", now=0.0) == 0.0
+    # Tokens refill over time
+    assert limiter.try_acquire("a", now=1.5) == 0.0
+
+def test_token_bucket_evicts_idle_clients():
+    limiter = TokenBucketLimiter(rate_per_sec=1.0, burst=1, max_clients=2)
+    for client in ("a", "b", "c"):
+        limiter.try_acquire(client, now=0.0)
+    assert len(limiter._buckets) == 2
+
+def test_admission_rejects_when_queue_full():
+    controller = AdmissionController(max_in_flight=1, max_queue_depth=1)
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.admit():
+                await release.wait()
+
+        async def queued():
+            async with controller.admit() as queue_wait:
+                return queue_wait
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(queued())
+        await asyncio.sleep(0)
+        assert controller.in_flight == 1 and controller.waiting == 1
+        with pytest.raises(AdmissionRejected) as excinfo:
+            async with controller.admit():
+                pass
+        assert excinfo.value.status_code == 503
+        assert excinfo.value.retry_after >= 1
+        release.set()
+        await holder
+        queue_wait = await waiter
+        assert queue_wait > 0
+        assert controller.in_flight == 0 and controller.waiting == 0
+
+    asyncio.run(scenario())
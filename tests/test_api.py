@@ -7,6 +7,27 @@ from PIL import Image
 
 client = TestClient(app)
 
+@pytest.fixture(autouse=True)
+def report_dir(tmp_path, monkeypatch):
+    import report_generation
+    monkeypatch.setattr(report_generation, "REPORT_DIR", str(tmp_path / "reports"))
+    monkeypatch.setenv("REPORT_WORKERS", "0")
+    # Each test starts with a full rate-limit bucket
+    import app as app_module
+    from admission import TokenBucketLimiter
+    monkeypatch.setattr(app_module, "rate_limiter", TokenBucketLimiter(rate_per_sec=1.0, burst=10))
+
+@pytest.fixture(autouse=True)
+def job_queue_dir(tmp_path, monkeypatch):
+    # Each test gets its own lazily created queue in tmp_path; its workers are stopped afterwards
+    import app as app_module
+    monkeypatch.setenv("JOB_DB_PATH", str(tmp_path / "jobs.db"))
+    monkeypatch.setattr(app_module, "_job_queue", None)
+    monkeypatch.setattr(app_module, "_job_pool", None)
+    yield
+    if app_module._job_pool is not None:
+        app_module._job_pool.stop()
+
 def create_test_image_bytes():
     img = Image.new('RGB', (512, 512), color='white')
     buf = io.BytesIO()
@@ -34,3 +55,191 @@ def test_analyze_endpoint_no_api_key(monkeypatch):
     data = response.json()
     assert data["rooftop"]["usable_area_m2"] == 0.0
     assert "No rooftop area detected" in data["rooftop"]["summary"]
+
+def test_jobs_endpoint_mock(monkeypatch, tmp_path):
+    import time
+    monkeypatch.setenv("MOCK_VISION_AI", "1")
+    response = client.post("/jobs", files={"file": ("test.png", create_test_image_bytes(), "image/png")}, data={"priority": "homeowner"})
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+    for _ in range(200):
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("completed", "failed"):
+            break
+        time.sleep(0.05)
+    assert job["status"] == "completed"
+    assert job["result"]["roi"]["cost_usd"] >= 0
+
+def test_jobs_endpoint_rejects_unknown_priority():
+    response = client.post("/jobs", files={"file": ("test.png", create_test_image_bytes(), "image/png")}, data={"priority": "vip"})
+    assert response.status_code == 400
+
+def test_jobs_endpoint_rejects_internal_webhook():
+    response = client.post(
+        "/jobs",
+        files={"file": ("test.png", create_test_image_bytes(), "image/png")},
+        data={"webhook_url": "http://127.0.0.1:8080/admin"}
+    )
+    assert response.status_code == 400
+
+def test_get_unknown_job():
+    assert client.get("/jobs/does-not-exist").status_code == 404
+
+def test_analyze_rejects_oversized_upload(monkeypatch):
+    import app as app_module
+    monkeypatch.setattr(app_module, "MAX_UPLOAD_BYTES", 100)
+    response = client.post("/analyze", files={"file": ("test.png", create_test_image_bytes(), "image/png")})
+    assert response.status_code == 413
+
+def test_analyze_rejects_chunked_upload_too_large(monkeypatch):
+    import app as app_module
+    monkeypatch.setattr(app_module, "MAX_UPLOAD_BYTES", 1000)
+    def body():
+        for _ in range(100):
+            yield b"x" * 500
+    # A generator body is sent chunked, with no Content-Length
+    response = client.post("/analyze", content=body(), headers={"Content-Type": "multipart/form-data; boundary=b"})
+    assert response.status_code == 413
+
+def test_analyze_rate_limited(monkeypatch):
+    import app as app_module
+    from admission import TokenBucketLimiter
+    monkeypatch.setattr(app_module, "rate_limiter", TokenBucketLimiter(rate_per_sec=0.001, burst=1))
+    monkeypatch.setenv("MOCK_VISION_AI", "1")
+    first = client.post("/analyze", files={"file": ("test.png", create_test_image_bytes(), "image/png")})
+    second = client.post("/analyze", files={"file": ("test.png", create_test_image_bytes(), "image/png")})
+    assert first.status_code == 200
+    assert second.status_code == 429
+    assert int(second.headers["Retry-After"]) >= 1
+
+def test_rate_limit_ignores_spoofed_forwarded_for(monkeypatch):
+    import app as app_module
+    from admission import TokenBucketLimiter
+    monkeypatch.setattr(app_module, "rate_limiter", TokenBucketLimiter(rate_per_sec=0.001, burst=1))
+    monkeypatch.setenv("MOCK_VISION_AI", "1")
+    statuses = [
+        client.post(
+            "/analyze",
+            files={"file": ("test.png", create_test_image_bytes(), "image/png")},
+            headers={"X-Forwarded-For": f"10.0.0.{i}"}
+        ).status_code
+        for i in range(3)
+    ]
+    assert statuses == [200, 429, 429]
+
+def test_client_id_behind_trusted_proxy(monkeypatch):
+    import ipaddress
+    import app as app_module
+    from starlette.requests import Request
+    monkeypatch.setattr(app_module, "TRUSTED_PROXIES", [ipaddress.ip_network("10.0.0.0/8")])
+    def make_request(peer, forwarded):
+        headers = [(b"x-forwarded-for", forwarded.encode())]
+        return Request({"type": "http", "headers": headers, "client": (peer, 1234)})
+    assert app_module.client_id(make_request("10.0.0.1", "1.2.3.4, 5.6.7.8, 10.0.0.2")) == "5.6.7.8"
+    assert app_module.client_id(make_request("9.9.9.9", "1.2.3.4")) == "9.9.9.9"
+
+def test_report_endpoint_serves_rendered_report(monkeypatch):
+    monkeypatch.setenv("MOCK_VISION_AI", "1")
+    data = client.post("/analyze", files={"file": ("test.png", create_test_image_bytes(), "image/png")}).json()
+    assert data["report_path"].endswith(".pdf")
+    response = client.get(data["report_url"])
+    assert response.status_code == 200
+    assert response.content.startswith(b"%PDF")
+    page = client.get(data["report_url"] + "?format=html")
+    assert page.status_code == 200
+    # The overlay the page references must load from wherever the page is served
+    import base64, re
+    src = re.search(r'<img src="([^"]+)"', page.text).group(1)
+    assert src.startswith("data:image/png;base64,")
+    assert base64.b64decode(src.split(",", 1)[1]).startswith(b"\x89PNG")
+    assert client.get("/reports/0123456789abcdef").status_code == 404
+
+def test_reevaluate_endpoint(monkeypatch):
+    monkeypatch.setenv("MOCK_VISION_AI", "1")
+    data = client.post("/analyze", files={"file": ("test.png", create_test_image_bytes(), "image/png")}).json()
+    response = client.post(f"/analyses/{data['analysis_id']}/reevaluate", json={"overrides": {"tariff_usd_per_kwh": 0.3}})
+    assert response.status_code == 200
+    assert response.json()["recomputed_stages"] == ["roi"]
+    bad = client.post(f"/analyses/{data['analysis_id']}/reevaluate", json={"overrides": {"panel_type": "Unknown"}})
+    assert bad.status_code == 400
+    bad_type = client.post(f"/analyses/{data['analysis_id']}/reevaluate", json={"overrides": {"financing": "loan"}})
+    assert bad_type.status_code == 400
+    # The JSON parser accepts Infinity/NaN literals; they must not reach the ROI maths
+    for literal in ("Infinity", "NaN"):
+        not_finite = client.post(
+            f"/analyses/{data['analysis_id']}/reevaluate",
+            content='{"overrides": {"price_per_panel_usd": %s}}' % literal,
+            headers={"Content-Type": "application/json"}
+        )
+        assert not_finite.status_code == 400
+    missing = client.post("/analyses/missing/reevaluate", json={"overrides": {}})
+    assert missing.status_code == 404
+
+def test_analyze_endpoint_msgpack(monkeypatch):
+    pytest.importorskip("msgpack")
+    from serialization import loads_msgpack
+    monkeypatch.setenv("MOCK_VISION_AI", "1")
+    response = client.post(
+        "/analyze",
+        files={"file": ("test.png", create_test_image_bytes(), "image/png")},
+        headers={"Accept": "application/msgpack"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/msgpack"
+    assert loads_msgpack(response.content)["rooftop"]["usable_area_m2"] > 0
+
+def test_ready_after_warmup(monkeypatch):
+    import time
+    monkeypatch.setenv("MOCK_VISION_AI", "1")
+    with TestClient(app) as warm_client:
+        for _ in range(100):
+            response = warm_client.get("/ready")
+            if response.status_code == 200:
+                break
+            time.sleep(0.02)
+    assert response.json() == {"status": "ready"}
+
+def test_analyze_stream_emits_stage_events(monkeypatch):
+    import json
+    monkeypatch.setenv("MOCK_VISION_AI", "1")
+    response = client.post("/analyze/stream", files={"file": ("test.jpg", create_test_image_bytes(), "image/jpeg")})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    events = [json.loads(line) for line in response.text.splitlines()]
+    stages = [event["stage"] for event in events]
+    assert stages == ["rooftop", "rooftop_validation", "shading", "assessment", "recommendation", "roi", "report", "done"]
+    assert events[-1]["status_code"] == 200
+    assert events[-1]["data"]["roi"] == events[5]["data"]
+    import app as app_module
+    assert app_module.admission.in_flight == 0
+
+def test_feedback_endpoint(monkeypatch, tmp_path):
+    import app as app_module
+    from user_feedback import FeedbackStore
+    store = FeedbackStore(str(tmp_path / "feedback.jsonl"))
+    monkeypatch.setattr(app_module, "feedback_store", store)
+    monkeypatch.setenv("MOCK_VISION_AI", "1")
+    data = client.post("/analyze", files={"file": ("test.png", create_test_image_bytes(), "image/png")}).json()
+    assert "needs_review" in data["rooftop_validation"]
+    response = client.post("/feedback", json={"analysis_id": data["analysis_id"], "verdict": "correct"})
+    assert response.status_code == 201
+    assert response.json()["accurate"] is True
+    records = list(store.iter_records())
+    assert records[0]["raw_confidence"] == data["rooftop"]["confidence"]
+    assert client.post("/feedback", json={"analysis_id": data["analysis_id"], "verdict": "maybe"}).status_code == 400
+    # Unknown analyses cannot inject arbitrary confidences into the calibration
+    unknown = client.post("/feedback", json={"analysis_id": "missing", "raw_confidence": 0.99, "verdict": "correct"})
+    assert unknown.status_code == 404
+    assert len(list(store.iter_records())) == 1
+
+def test_feedback_is_rate_limited(monkeypatch, tmp_path):
+    import app as app_module
+    from admission import TokenBucketLimiter
+    from user_feedback import FeedbackStore
+    monkeypatch.setattr(app_module, "feedback_store", FeedbackStore(str(tmp_path / "feedback.jsonl")))
+    monkeypatch.setenv("MOCK_VISION_AI", "1")
+    data = client.post("/analyze", files={"file": ("test.png", create_test_image_bytes(), "image/png")}).json()
+    monkeypatch.setattr(app_module, "rate_limiter", TokenBucketLimiter(rate_per_sec=0.001, burst=1))
+    payload = {"analysis_id": data["analysis_id"], "verdict": "incorrect"}
+    assert client.post("/feedback", json=payload).status_code == 201
+    assert client.post("/feedback", json=payload).status_code == 429
@@ -0,0 +1,79 @@
+import pytest
+import calibration
+from calibration import (
+    CALIBRATION_BINS, build_lookup_table, fit_calibration, fit_isotonic, load_calibration, run_calibration_job
+)
+from user_feedback import FeedbackStore, collect_user_feedback, make_feedback_record
+
+@pytest.fixture(autouse=True)
+def reset_calibration():
+    yield
+    calibration.set_calibration(None)
+
+def test_fit_isotonic_pools_violators():
+    steps = fit_isotonic([0.1, 0.2, 0.3, 0.4], [0, 1, 0, 1])
+    values = [v for _, v in steps]
+    assert values == sorted(values)
+    assert steps[0] == (0.1, 0.0)
+    assert steps[1] == (0.3, 0.5)
+
+def test_fit_isotonic_averages_tied_confidences():
+    # 8/10 correct at 0.8, 1/2 correct at 0.6
+    steps = fit_isotonic([0.8] * 10 + [0.6] * 2, [1] * 8 + [0] * 2 + [1, 0])
+    assert steps == [(0.6, 0.5), (0.8, 0.8)]
+    assert build_lookup_table(steps)[80] == 0.8
+    # Lower accuracy at a higher tied confidence pools the two groups
+    steps = fit_isotonic([0.8] * 10 + [0.9] * 4, [1] * 8 + [0] * 2 + [1, 0, 1, 0])
+    assert steps == [(0.9, 10 / 14)]
+
+def test_build_lookup_table_is_monotone():
+    table = build_lookup_table([(0.5, 0.2), (1.0, 0.9)])
+    assert len(table) == CALIBRATION_BINS
+    assert table[0] == 0.2 and table[50] == 0.2 and table[51] == 0.9 and table[100] == 0.9
+
+def test_fit_calibration_requires_min_samples():
+    records = [{"raw_confidence": 0.9, "accurate": True}] * 3
+    assert fit_calibration(records, min_samples=10) is None
+    assert fit_calibration(records, min_samples=3)["base_rate"] == 1.0
+
+def test_make_feedback_record():
+    assert make_feedback_record(0.9, verdict="correct")["accurate"]
+    assert make_feedback_record(0.9, predicted_area_m2=100, corrected_area_m2=110)["accurate"]
+    assert not make_feedback_record(0.9, predicted_area_m2=100, corrected_area_m2=60)["accurate"]
+    with pytest.raises(ValueError):
+        make_feedback_record(0.9)
+    with pytest.raises(ValueError):
+        make_feedback_record(0.9, verdict="maybe")
+
+def test_feedback_roundtrip_and_calibration_job(tmp_path):
+    feedback_path = str(tmp_path / "feedback.jsonl")
+    calibration_path = str(tmp_path / "calibration.json")
+    store = FeedbackStore(feedback_path)
+    context = {"rooftop": {"confidence": 0.9, "usable_area_m2": 100}, "analysis_id": "a1"}
+    assert collect_user_feedback("report.pdf", context, store=store) is None
+    for i in range(5):
+        collect_user_feedback("report.pdf", dict(context, analysis_id=f"a{i}"), verdict="correct", store=store)
+        store.append(make_feedback_record(0.6, verdict="incorrect"))
+    assert len(list(store.iter_records())) == 10
+
+    assert run_calibration_job(feedback_path, calibration_path, min_samples=20) is None
+    fitted = run_calibration_job(feedback_path, calibration_path, min_samples=10)
+    assert fitted["samples"] == 10
+    assert calibration.calibrate(0.9) == 1.0
+    assert calibration.calibrate(0.6) == 0.0
+
+    calibration.set_calibration(None)
+    assert calibration.calibrate(0.6) == 0.6
+    load_calibration(calibration_path)
+    assert calibration.calibrate(0.6) == 0.0
+
+def test_fit_calibration_keeps_latest_record_per_analysis():
+    records = [make_feedback_record(0.8, verdict="correct", analysis_id=f"a{i}") for i in range(4)]
+    baseline = fit_calibration(records, min_samples=4)
+    # Flooding one analysis with repeats only replaces its own record
+    flooded = records + [make_feedback_record(0.8, verdict="incorrect", analysis_id="a0") for _ in range(50)]
+    fitted = fit_calibration(flooded, min_samples=4)
+    assert fitted["samples"] == 4
+    assert fitted["table"][80] == 0.75
+    assert baseline["table"][80] == 1.0
+    assert fit_calibration(flooded + flooded[-1:], min_samples=4)["table"] == fitted["table"]
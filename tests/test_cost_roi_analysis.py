@@ -14,3 +14,23 @@ def test_analyze_cost_and_roi_zero_panels():
     context = {"recommendation": {"num_panels": 0}}
     roi = analyze_cost_and_roi(context)
     assert roi["cost_usd"] == 0
+
+def test_analyze_cost_and_roi_with_tariff_and_loan():
+    context = {
+        "recommendation": {"num_panels": 10, "system_size_kw": 4.0},
+        "weather": {"average_irradiance_kwh_m2_year": 1700},
+        "parameters": {"tariff_usd_per_kwh": 0.2, "financing": {"type": "loan", "annual_rate": 0.0, "term_years": 10}}
+    }
+    roi = analyze_cost_and_roi(context)
+    assert roi["estimated_annual_production_kwh"] == 5440.0
+    assert roi["estimated_annual_savings_usd"] == 1088.0
+    assert roi["payback_period_years"] == round(3000 / 1088.0, 1)
+    assert roi["financing"]["monthly_payment_usd"] == 25.0
+
+def test_analyze_cost_and_roi_price_override_updates_roi():
+    context = {"recommendation": {"num_panels": 10}, "parameters": {"price_per_panel_usd": 600}}
+    roi = analyze_cost_and_roi(context)
+    assert roi["cost_usd"] == 6000
+    assert roi["estimated_annual_savings_usd"] == 1600
+    assert roi["roi_percent"] == round(1600 / 4000 * 100, 1)
+    assert roi["payback_period_years"] == 2.5
@@ -0,0 +1,128 @@
+import time
+import pytest
+import job_queue
+from job_queue import JobQueue, JobWorkerPool
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"))
+
+def test_priority_classes_order_claims(queue):
+    bulk = queue.submit(b"bulk", "bulk.png", "portfolio")
+    home = queue.submit(b"home", "home.png", "homeowner")
+    first = queue.claim_next(timeout=0)
+    second = queue.claim_next(timeout=0)
+    assert first["id"] == home
+    assert second["id"] == bulk
+    assert queue.claim_next(timeout=0) is None
+
+def test_unknown_priority_rejected(queue):
+    with pytest.raises(ValueError):
+        queue.submit(b"x", "x.png", "vip")
+
+def test_complete_and_get(queue):
+    job_id = queue.submit(b"data", "a.png")
+    assert queue.get(job_id)["status"] == "queued"
+    queue.claim_next(timeout=0)
+    assert queue.get(job_id)["status"] == "running"
+    queue.complete(job_id, {"roi": {"cost_usd": 100}}, 200)
+    job = queue.get(job_id)
+    assert job["status"] == "completed"
+    assert job["result"]["roi"]["cost_usd"] == 100
+    assert queue.get("missing") is None
+
+def test_jobs_persist_and_requeue(tmp_path):
+    db_path = str(tmp_path / "jobs.db")
+    job_id = JobQueue(db_path).submit(b"data", "a.png")
+    reopened = JobQueue(db_path)
+    reopened.claim_next(timeout=0)
+    # Still within its lease: another live process may be running it
+    assert reopened.requeue_interrupted() == 0
+    assert reopened.requeue_interrupted(lease_timeout=0) == 1
+    assert reopened.get(job_id)["status"] == "queued"
+
+def test_concurrent_claims_across_connections(tmp_path):
+    import threading
+    db_path = str(tmp_path / "jobs.db")
+    queues = [JobQueue(db_path), JobQueue(db_path)]
+    job_ids = {queues[0].submit(b"x", f"{i}.png") for i in range(40)}
+    claimed = []
+    def drain(queue):
+        while True:
+            job = queue.claim_next(timeout=0)
+            if job is None:
+                return
+            claimed.append(job["id"])
+    threads = [threading.Thread(target=drain, args=(queues[i % 2],)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(job_ids)
+
+def test_worker_pool_runs_handler_and_webhook(queue, monkeypatch):
+    delivered = []
+    monkeypatch.setattr(job_queue, "notify_webhook", lambda url, payload: delivered.append((url, payload)))
+    pool = JobWorkerPool(queue, lambda job: ({"size": len(job["payload"])}, 200), num_workers=2, poll_interval=0.05)
+    pool.start()
+    try:
+        job_id = queue.submit(b"12345", "a.png", webhook_url="http://example.invalid/hook")
+        for _ in range(100):
+            if queue.get(job_id)["status"] == "completed" and delivered:
+                break
+            time.sleep(0.02)
+    finally:
+        pool.stop()
+    assert queue.get(job_id)["result"] == {"size": 5}
+    assert delivered[0][0] == "http://example.invalid/hook"
+    assert delivered[0][1]["status"] == "completed"
+
+def test_worker_pool_records_handler_errors(queue):
+    def boom(job):
+        raise RuntimeError("boom")
+    pool = JobWorkerPool(queue, boom, num_workers=1, poll_interval=0.05)
+    pool.start()
+    try:
+        job_id = queue.submit(b"x", "a.png")
+        for _ in range(100):
+            if queue.get(job_id)["status"] == "failed":
+                break
+            time.sleep(0.02)
+    finally:
+        pool.stop()
+    assert queue.get(job_id)["error"] == "boom"
+
+def test_validate_webhook_url(monkeypatch):
+    import socket
+    from job_queue import validate_webhook_url
+    resolved = {"hooks.example.com": "93.184.216.34", "internal.example.com": "10.0.0.5", "localhost": "127.0.0.1"}
+    monkeypatch.setattr(socket, "getaddrinfo", lambda host, *args, **kwargs: [(None, None, None, "", (resolved[host], 443))])
+    validate_webhook_url("https://hooks.example.com/hook")
+    for url in ("http://hooks.example.com/hook", "https://internal.example.com/hook", "https://localhost/hook", "file:///etc/passwd"):
+        with pytest.raises(ValueError):
+            validate_webhook_url(url)
+    monkeypatch.setattr(job_queue, "WEBHOOK_ALLOWED_HOSTS", {"other.example.com"})
+    with pytest.raises(ValueError):
+        validate_webhook_url("https://hooks.example.com/hook")
+
+def test_notify_webhook_pins_validated_address(monkeypatch):
+    import socket
+    import urllib3
+    # A rebinding host: public on the first lookup, loopback on any later one
+    answers = iter(["93.184.216.34", "127.0.0.1"])
+    monkeypatch.setattr(socket, "getaddrinfo", lambda host, *args, **kwargs: [(None, None, None, "", (next(answers), 443))])
+    calls = []
+    class FakePool:
+        def __init__(self, host, **kwargs):
+            calls.append(("pool", host, kwargs))
+        def urlopen(self, method, path, **kwargs):
+            calls.append(("request", method, path, kwargs))
+            return type("Response", (), {"status": 204})()
+    monkeypatch.setattr(urllib3, "HTTPSConnectionPool", FakePool)
+    job_queue.notify_webhook("https://hooks.example.com/hook?x=1", {"status": "completed"})
+    (_, host, pool_kwargs), (_, method, path, request_kwargs) = calls
+    assert host == "93.184.216.34"
+    assert pool_kwargs["server_hostname"] == "hooks.example.com"
+    assert path == "/hook?x=1"
+    assert request_kwargs["headers"]["Host"] == "hooks.example.com"
+    assert request_kwargs["redirect"] is False
@@ -0,0 +1,65 @@
+import pytest
+from PIL import Image
+import pipeline
+from pipeline import run_analysis_pipeline, reevaluate_analysis, invalidated_stages
+
+@pytest.fixture(autouse=True)
+def inline_reports(tmp_path, monkeypatch):
+    import report_generation
+    monkeypatch.setattr(report_generation, "REPORT_DIR", str(tmp_path))
+    monkeypatch.setenv("REPORT_WORKERS", "0")
+    monkeypatch.setenv("MOCK_VISION_AI", "1")
+
+def test_invalidated_stages():
+    assert invalidated_stages({}) == []
+    assert invalidated_stages({"tariff_usd_per_kwh": 0.2}) == ["roi"]
+    assert invalidated_stages({"panel_type": "Thin-film 150W", "financing": {"type": "cash"}}) == ["recommendation", "roi"]
+    with pytest.raises(ValueError):
+        invalidated_stages({"roof_color": "red"})
+
+@pytest.mark.parametrize("overrides", [
+    {"financing": "loan"},
+    {"financing": {"type": "loan", "annual_rate": "5%"}},
+    {"tariff_usd_per_kwh": "x"},
+    {"price_per_panel_usd": "600"},
+    {"price_per_panel_usd": -100},
+    {"panel_type": ["Thin-film 150W"]},
+    {"price_per_panel_usd": float("inf")},
+    {"tariff_usd_per_kwh": float("nan")},
+])
+def test_invalidated_stages_rejects_bad_values(overrides):
+    with pytest.raises(ValueError):
+        invalidated_stages(overrides)
+
+def test_reevaluate_skips_detection(monkeypatch):
+    context, status = run_analysis_pipeline(Image.new("RGB", (512, 512), "white"), "test.png")
+    assert status == 200
+    monkeypatch.setattr(pipeline, "detect_and_segment_rooftop", lambda image: pytest.fail("detection rerun"))
+    monkeypatch.setattr(pipeline, "analyze_shading_and_obstacles", lambda image, rooftop: pytest.fail("shading rerun"))
+
+    requote = reevaluate_analysis(context["analysis_id"], {"panel_type": "Thin-film 150W", "tariff_usd_per_kwh": 0.25})
+    assert requote["recomputed_stages"] == ["recommendation", "roi"]
+    assert requote["recommendation"]["panel_type"] == "Thin-film 150W"
+    assert requote["roi"]["estimated_annual_savings_usd"] != context["roi"]["estimated_annual_savings_usd"]
+    assert requote["rooftop"] == context["rooftop"]
+    assert requote["parent_analysis_id"] == context["analysis_id"]
+    assert requote["analysis_id"] != context["analysis_id"]
+
+    # Overrides accumulate across chained re-quotes, and the original snapshot is untouched
+    second = reevaluate_analysis(requote["analysis_id"], {"financing": {"type": "loan", "annual_rate": 0.05, "term_years": 10}})
+    assert second["recomputed_stages"] == ["roi"]
+    assert second["parameters"]["panel_type"] == "Thin-film 150W"
+    assert "monthly_payment_usd" in second["roi"]["financing"]
+    assert pipeline.analysis_store.get(context["analysis_id"])["parameters"] == {}
+
+def test_reevaluate_unknown_analysis():
+    assert reevaluate_analysis("missing", {"tariff_usd_per_kwh": 0.2}) is None
+
+def test_requote_chain_reuses_report_for_same_figures():
+    context, _ = run_analysis_pipeline(Image.new("RGB", (512, 512), "white"), "test.png")
+    b = reevaluate_analysis(context["analysis_id"], {"tariff_usd_per_kwh": 0.3})
+    c = reevaluate_analysis(b["analysis_id"], {"tariff_usd_per_kwh": 0.2})
+    d = reevaluate_analysis(c["analysis_id"], {"tariff_usd_per_kwh": 0.3})
+    assert d["roi"] == b["roi"]
+    assert d["report_url"] == b["report_url"]
+    assert c["report_url"] != b["report_url"]
@@ -0,0 +1,77 @@
+import json
+import pytest
+from PIL import Image
+from portfolio import (
+    lonlat_to_tile, tile_pixel_to_lonlat, tile_range, iter_tiles, polygon_area,
+    run_portfolio, SeamDeduplicator, bounded_map
+)
+
+ZOOM = 19
+X0, Y0 = 84000, 202000
+
+def fake_fetch_tile(zoom, x, y):
+    return Image.new("RGB", (512, 512), "gray")
+
+def two_tile_bbox():
+    # Covers tiles (X0, Y0) and (X0 + 1, Y0)
+    min_lon, max_lat = tile_pixel_to_lonlat(ZOOM, X0, Y0, 50, 50)
+    max_lon, min_lat = tile_pixel_to_lonlat(ZOOM, X0 + 1, Y0, 460, 460)
+    return (min_lon, min_lat, max_lon, max_lat)
+
+def square(value):
+    return value * value
+
+def test_tile_math_roundtrip():
+    lon, lat = tile_pixel_to_lonlat(ZOOM, X0, Y0, 0, 0)
+    x, y = lonlat_to_tile(lon, lat, ZOOM)
+    assert x == pytest.approx(X0) and y == pytest.approx(Y0)
+    assert tile_range(two_tile_bbox(), ZOOM) == (X0, X0 + 1, Y0, Y0)
+    assert list(iter_tiles(two_tile_bbox(), ZOOM)) == [(X0, Y0), (X0 + 1, Y0)]
+    with pytest.raises(ValueError):
+        tile_range((1, 1, 0, 0), ZOOM)
+
+def test_polygon_area():
+    assert polygon_area([[0, 0], [10, 0], [10, 5], [0, 5]]) == 50
+
+def fragment(bbox, seams):
+    return {"tile": (ZOOM, 0, 0), "polygon": [], "bbox": bbox, "seams": seams, "usable_area_m2": 10.0,
+            "confidence": 0.9, "shading": "shading_map"}
+
+def test_seam_deduplicator_merges_across_seam_and_holds_until_closed():
+    dedup = SeamDeduplicator((0, 1), (0, 0))
+    left = fragment([0.9, 0.0, 1.0, 1.0], [("v", 1, 0)])
+    right = fragment([1.0, 0.5, 1.1, 1.5], [("v", 1, 0)])
+    assert dedup.add_tile((0, 0), [left]) == []
+    assert dedup.pending() == 1
+    finished = dedup.add_tile((1, 0), [right])
+    assert len(finished) == 1
+    assert finished[0]["merged_fragments"] == 2
+    assert finished[0]["usable_area_m2"] == 20.0
+    assert finished[0]["bbox"] == [0.9, 0.0, 1.1, 1.5]
+    assert dedup.pending() == 0
+
+def test_seam_deduplicator_keeps_non_overlapping_fragments_apart():
+    dedup = SeamDeduplicator((0, 1), (0, 0))
+    dedup.add_tile((0, 0), [fragment([0.9, 0.0, 1.0, 1.0], [("v", 1, 0)])])
+    finished = dedup.add_tile((1, 0), [fragment([1.0, 2.0, 1.1, 3.0], [("v", 1, 0)])])
+    assert sorted(b["merged_fragments"] for b in finished) == [1, 1]
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_run_portfolio_streams_deduplicated_geojson(tmp_path, monkeypatch, workers):
+    monkeypatch.setenv("MOCK_VISION_AI", "1")
+    out = tmp_path / "portfolio.geojson"
+    summary = run_portfolio(two_tile_bbox(), str(out), zoom=ZOOM, workers=workers, fetch_tile=fake_fetch_tile)
+    assert summary["tiles"] == 2 and summary["failed_tiles"] == 0
+    collection = json.loads(out.read_text())
+    features = collection["features"]
+    # Per mock tile: one interior roof plus halves of a roof on each side seam.
+    # The shared seam's halves merge; the outer halves lie on the run boundary.
+    assert summary["buildings"] == len(features) == 5
+    merged = [f for f in features if f["properties"]["merged_fragments"] == 2]
+    assert len(merged) == 1
+    assert merged[0]["properties"]["num_panels"] > 0
+    assert len({f["properties"]["building_id"] for f in features}) == 5
+
+def test_bounded_map_inline_and_pool():
+    assert sorted(bounded_map(square, [(i,) for i in range(10)], workers=0)) == [i * i for i in range(10)]
+    assert sorted(bounded_map(square, ((i,) for i in range(10)), workers=2, max_in_flight=2)) == [i * i for i in range(10)]
@@ -0,0 +1,114 @@
+import os
+import pytest
+from PIL import Image
+import report_generation
+from report_generation import generate_report, generate_reports, report_cache_key, report_paths, render_overlay, parse_polygon
+
+@pytest.fixture
+def report_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(report_generation, "REPORT_DIR", str(tmp_path))
+    return tmp_path
+
+def make_context(num_panels=10):
+    return {
+        "image": Image.new("RGB", (512, 512), "white"),
+        "rooftop": {"mask": "POLYGON((100,100),(400,100),(400,400),(100,400))", "usable_area_m2": 42.3, "summary": "Rooftop detected."},
+        "rooftop_validation": {"is_valid": True, "validation_msg": "Valid rooftop result.", "confidence": 0.9},
+        "assessment": {"usable_area_m2": 42.3, "layout_options": [{"panel_count": 21}]},
+        "recommendation": {"num_panels": num_panels, "layout": [{"x": 150, "y": 150, "width": 1, "height": 2}]},
+        "roi": {"cost_usd": num_panels * 500},
+        "performance": {"total_analysis_sec": 0.1},
+    }
+
+def test_parse_polygon():
+    assert parse_polygon("POLYGON((100,100),(400,100),(400,400))") == [(100.0, 100.0), (400.0, 100.0), (400.0, 400.0)]
+    assert parse_polygon(None) == []
+
+def test_render_overlay_draws_roof_and_panels():
+    overlay = render_overlay(make_context())
+    assert overlay.size == (512, 512)
+    assert overlay.getpixel((10, 10)) == (255, 255, 255)
+    assert overlay.getpixel((250, 300)) != (255, 255, 255)  # rooftop polygon
+    assert overlay.getpixel((155, 160)) != overlay.getpixel((250, 300))  # panel
+
+def test_generate_report_writes_pdf_and_html(report_dir):
+    path = generate_report(make_context())
+    assert os.path.dirname(path) == str(report_dir)
+    with open(path, "rb") as f:
+        assert f.read(4) == b"%PDF"
+    key = os.path.basename(path)[:-4]
+    with open(report_paths(key)["html"], encoding="utf-8") as f:
+        html_doc = f.read()
+    assert "Rooftop detected." in html_doc
+    assert "Cost &amp; ROI" in html_doc
+
+def test_generate_report_is_cached_by_content(report_dir, monkeypatch):
+    first = generate_report(make_context())
+    # Volatile fields such as timings do not change the key
+    context = make_context()
+    context["performance"] = {"total_analysis_sec": 9.9}
+    monkeypatch.setattr(report_generation, "render_report", lambda *a, **k: pytest.fail("re-rendered a cached report"))
+    assert generate_report(context) == first
+    assert report_cache_key(make_context(num_panels=11)) != report_cache_key(make_context())
+
+def test_generate_reports_bulk(report_dir, monkeypatch):
+    monkeypatch.setenv("REPORT_WORKERS", "2")
+    monkeypatch.setattr(report_generation, "_pool", None)
+    try:
+        paths = generate_reports([make_context(n) for n in range(1, 4)])
+    finally:
+        report_generation._pool.shutdown()
+    assert len(set(paths)) == 3
+    assert all(os.path.exists(p) for p in paths)
+
+def test_submit_report_deduplicates_concurrent_and_retries_failed(report_dir, monkeypatch):
+    import threading
+    from concurrent.futures import Future
+    submitted = []
+    class FakePool:
+        def submit(self, fn, *args):
+            future = Future()
+            submitted.append(future)
+            return future
+    monkeypatch.setenv("REPORT_WORKERS", "2")
+    monkeypatch.setattr(report_generation, "_get_pool", lambda: FakePool())
+    monkeypatch.setattr(report_generation, "_pending", {})
+    context = make_context()
+    barrier = threading.Barrier(8)
+    def submit():
+        barrier.wait()
+        report_generation.submit_report(context)
+    threads = [threading.Thread(target=submit) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(submitted) == 1
+    key = report_cache_key(context)
+    submitted[0].set_exception(RuntimeError("render failed"))
+    assert report_generation.report_status(key) == "failed"
+    report_generation.submit_report(context)
+    assert len(submitted) == 2
+    assert report_generation.report_status(key) == "rendering"
+    submitted[1].set_result(None)
+    assert key not in report_generation._pending
+
+def test_evict_reports_by_age_and_size(report_dir):
+    def write_report(key, mtime, size=100):
+        for path in report_paths(key).values():
+            with open(path, "wb") as f:
+                f.write(b"x" * size)
+            os.utime(path, (mtime, mtime))
+    old, middle, new = "a" * 32, "b" * 32, "c" * 32
+    write_report(old, 1000)
+    write_report(middle, 5000)
+    write_report(new, 6000)
+    (report_dir / "notes.txt").write_text("unrelated")
+    # Past the age limit
+    assert report_generation.evict_reports(max_age_sec=2000, max_bytes=10 ** 9, now=6000) == 1
+    assert not os.path.exists(report_paths(old)["pdf"])
+    # Over the size limit: least recently written goes first
+    assert report_generation.evict_reports(max_age_sec=10 ** 9, max_bytes=300, now=6000) == 1
+    assert not os.path.exists(report_paths(middle)["overlay"])
+    assert os.path.exists(report_paths(new)["pdf"])
+    assert (report_dir / "notes.txt").exists()
@@ -0,0 +1,70 @@
+import json
+import pytest
+from serialization import (
+    compact, expand, encode_array, decode_array, rle_encode_mask, rle_decode_mask,
+    negotiate, render_context, dumps_json
+)
+
+def test_rle_mask_roundtrip():
+    mask = [[0, 0, 1, 1], [1, 1, 1, 0], [0, 0, 0, 0]]
+    encoded = rle_encode_mask(mask)
+    assert encoded["counts"] == [2, 5, 5]
+    assert rle_decode_mask(encoded) == mask
+    assert rle_decode_mask(rle_encode_mask([[1, 0]])) == [[1, 0]]
+
+def test_array_roundtrip_little_endian():
+    packed = encode_array([1, 2, 3])
+    assert packed["__array__"] == "<i1"
+    assert decode_array(packed) == [1, 2, 3]
+    wide = encode_array([1, 2 ** 40])
+    assert wide["__array__"] == "<i8"
+    assert wide["data"][:8] == (1).to_bytes(8, "little")
+    assert decode_array(wide) == [1, 2 ** 40]
+    floats = [0.5 * i for i in range(100)]
+    assert decode_array(encode_array(floats)) == floats
+
+def test_compact_expand_roundtrip():
+    context = {
+        "rooftop": {"mask": "POLYGON((1,1),(2,2),(3,3))", "usable_area_m2": 42.3},
+        "shading": {"shade_mask": [[0, 1], [1, 1]], "hourly_kwh": [float(h) for h in range(8760)]},
+        "recommendation": {"layout": [{"x": 10, "y": 20}]},
+    }
+    packed = compact(context)
+    assert "counts" in packed["shading"]["shade_mask"]
+    assert isinstance(packed["shading"]["hourly_kwh"]["data"], bytes)
+    assert packed["rooftop"] == context["rooftop"]
+    assert expand(packed) == context
+
+def test_ragged_mask_is_not_rle_encoded():
+    context = {"shade_mask": [[0], [1, 1]]}
+    packed = compact(context)
+    assert packed == context
+    assert expand(packed) == context
+
+def test_negotiate():
+    assert negotiate(None) == "application/json"
+    assert negotiate("*/*") == "application/json"
+    assert negotiate("text/html") == "application/json"
+
+def test_msgpack_response():
+    msgpack = pytest.importorskip("msgpack")
+    from serialization import loads_msgpack
+    assert negotiate("application/x-msgpack, application/json;q=0.5") == "application/msgpack"
+    context = {"hourly": list(range(200)), "roi": {"cost_usd": 5000}}
+    response = render_context(context, "application/msgpack")
+    assert response.media_type == "application/msgpack"
+    assert loads_msgpack(response.body) == context
+    assert len(response.body) < len(dumps_json(context))
+
+def test_negotiate_respects_q_values():
+    pytest.importorskip("msgpack")
+    assert negotiate("application/msgpack;q=0, application/json") == "application/json"
+    assert negotiate("application/json;q=0.5, application/msgpack") == "application/msgpack"
+    assert negotiate("application/msgpack;q=0.4, application/json;q=0.9") == "application/json"
+    assert negotiate("application/msgpack;q=0") == "application/json"
+
+def test_json_response_matches_stdlib():
+    context = {"roi": {"cost_usd": 5000, "roi_percent": 17.8}, "summary": "ok"}
+    response = render_context(context, "application/json", status_code=400)
+    assert response.status_code == 400
+    assert json.loads(response.body) == context
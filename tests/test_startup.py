@@ -0,0 +1,13 @@
+import os
+import subprocess
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.mark.parametrize("module", ["main", "app"])
+def test_entry_point_does_not_import_heavy_dependencies(module):
+    code = f"import sys, {module}; print(','.join(m for m in ('openai', 'requests') if m in sys.modules))"
+    env = dict(os.environ, MOCK_VISION_AI="1")
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""
@@ -14,3 +14,11 @@ def test_recommend_system_zero_panels():
     context = {"assessment": {"layout_options": [{"panel_count": 0}]}}
     rec = recommend_system(context)
     assert rec["num_panels"] == 0
+
+def test_recommend_system_panel_type_parameter():
+    context = {"assessment": {"layout_options": [{"panel_count": 10}]}, "parameters": {"panel_type": "Thin-film 150W"}}
+    rec = recommend_system(context)
+    assert rec["panel_type"] == "Thin-film 150W"
+    assert rec["system_size_kw"] == 1.5
+    with pytest.raises(ValueError):
+        recommend_system({"parameters": {"panel_type": "Unknown"}})
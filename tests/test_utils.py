@@ -23,3 +23,17 @@ def test_compute_confidence_score():
     result = {"mask": "polygon coordinates...", "usable_area_m2": 42.3, "summary": "test"}
     score = compute_confidence_score(result)
     assert 0 <= score <= 1
+
+def test_compute_confidence_score_uses_calibration():
+    import calibration
+    from utils import needs_manual_review
+    table = [0.5] * 50 + [0.9] * 51
+    calibration.set_calibration({"table": table, "base_rate": 0.8, "samples": 100})
+    try:
+        assert compute_confidence_score({"confidence": 0.3}) == 0.5
+        assert compute_confidence_score({"confidence": 0.75}) == 0.9
+        assert compute_confidence_score({}) == 0.8
+        assert needs_manual_review(0.5)
+        assert not needs_manual_review(0.9)
+    finally:
+        calibration.set_calibration(None)
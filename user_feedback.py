@@ -1,12 +1,97 @@
 # Handles user feedback collection
+import json
+import os
+import threading
+import time
 
-def collect_user_feedback(report_path):
+FEEDBACK_PATH = os.environ.get("FEEDBACK_PATH", "feedback.jsonl")
+
+VERDICTS = ("correct", "incorrect")
+
+# A detection counts as accurate when the corrected area is within this relative error
+AREA_TOLERANCE = 0.15
+
+
+class FeedbackStore:
+    """
+    Append-only JSON Lines log of user corrections. Records are never rewritten,
+    so the file can be appended to by the API while the calibration job reads it.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or FEEDBACK_PATH
+        self._lock = threading.Lock()
+
+    def append(self, record):
+        line = json.dumps(record, sort_keys=True) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+        return record
+
+    def iter_records(self):
+        """Yield stored records, skipping any partially written trailing line."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def make_feedback_record(raw_confidence, verdict=None, predicted_area_m2=None, corrected_area_m2=None, analysis_id=None):
+    """
+    Build a feedback record and derive whether the detection was accurate.
+    Raises ValueError if neither a verdict nor a corrected area is given.
+    """
+    if verdict is not None and verdict not in VERDICTS:
+        raise ValueError(f"Unknown verdict: {verdict}. Expected one of: {', '.join(VERDICTS)}")
+    if verdict is None and corrected_area_m2 is None:
+        raise ValueError("Feedback needs a verdict or a corrected_area_m2.")
+    raw_confidence = float(raw_confidence)
+    if not 0 <= raw_confidence <= 1:
+        raise ValueError("raw_confidence must be between 0 and 1.")
+    if verdict is not None:
+        accurate = verdict == "correct"
+    elif not predicted_area_m2:
+        raise ValueError("A corrected area needs the predicted area to compare against.")
+    else:
+        corrected = float(corrected_area_m2)
+        accurate = corrected > 0 and abs(float(predicted_area_m2) - corrected) / corrected <= AREA_TOLERANCE
+    return {
+        "analysis_id": analysis_id,
+        "raw_confidence": raw_confidence,
+        "predicted_area_m2": predicted_area_m2,
+        "corrected_area_m2": corrected_area_m2,
+        "verdict": verdict,
+        "accurate": accurate,
+        "timestamp": time.time()
+    }
+
+
+def collect_user_feedback(report_path, context=None, verdict=None, corrected_area_m2=None, store=None):
     """
     Collect feedback from user for continuous improvement.
     Args:
         report_path: Path to the generated report
+        context: Workflow context (supplies the raw confidence and predicted area)
+        verdict: 'correct' or 'incorrect', if the user gave one
+        corrected_area_m2: User-corrected usable area, if given
+        store: FeedbackStore to append to (defaults to FEEDBACK_PATH)
     Returns:
-        feedback: Collected feedback (placeholder)
+        feedback: The stored record, or None when the user gave no feedback
     """
-    # TODO: Implement user feedback collection
-    return "feedback"
+    if verdict is None and corrected_area_m2 is None:
+        return None
+    rooftop = (context or {}).get('rooftop') or {}
+    record = make_feedback_record(
+        rooftop.get('confidence', 0.0),
+        verdict=verdict,
+        predicted_area_m2=rooftop.get('usable_area_m2'),
+        corrected_area_m2=corrected_area_m2,
+        analysis_id=(context or {}).get('analysis_id')
+    )
+    record["report_path"] = report_path
+    return (store or FeedbackStore()).append(record)
@@ -1,4 +1,10 @@
 # Shared utility functions for the project
+import os
+
+import calibration
+
+# Calibrated confidence at or above this skips manual re-review
+REVIEW_THRESHOLD = float(os.environ.get("REVIEW_THRESHOLD", "0.7"))
 
 def validate_rooftop_result(result):
     """
@@ -21,13 +27,19 @@ def validate_rooftop_result(result):
 def compute_confidence_score(result):
     """
     Compute a confidence score for the Vision AI output.
-    Returns the 'confidence' field if present and valid, else 0.95 as fallback.
+    Returns the 'confidence' field mapped through the feedback calibration (if one is loaded).
+    Falls back to the observed accuracy across all feedback, or 0.95 before any calibration exists.
     """
     if isinstance(result, dict) and "confidence" in result:
         try:
             conf = float(result["confidence"])
             if 0 <= conf <= 1:
-                return conf
+                return calibration.calibrate(conf)
         except Exception:
             pass
-    return 0.95
+    fallback = calibration.base_rate()
+    return fallback if fallback is not None else 0.95
+
+def needs_manual_review(confidence):
+    """Whether a validated result's (calibrated) confidence is too low to trust without review."""
+    return confidence < REVIEW_THRESHOLD